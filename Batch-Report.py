@@ -0,0 +1,34 @@
+'''
+python3 Batch-Report.py reports.manifest.tsv [--workers 4] [--fdr 0.01] [--plot-mode auto|scatter|density]
+
+Writes the per-sample reports of every sample in the manifest from one process,
+so pandas, matplotlib and reportlab are imported once instead of once per sample.
+With --workers above 1 the samples are split over worker processes.
+The manifest is tab-separated with the header of report_engine.MANIFEST_COLUMNS;
+the mode column is DDA, DIA or the sample's .acqmode.tsv sidecar.
+Exits 1 if any report failed, after writing all the others. With profiling on
+(profiling.py) every sample is profiled on its own, in the process that writes it.
+'''
+import argparse
+import sys
+import time
+from report_engine import read_manifest, write_reports
+from report_plots import PLOT_MODES
+from psm_cache import DEFAULT_FDR
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the per-sample QC reports listed in a manifest.")
+    parser.add_argument('manifest')
+    parser.add_argument('--workers', type=int, default=1, help="processes writing reports")
+    parser.add_argument('--fdr', type=float, default=DEFAULT_FDR, help="q-value cutoff for the identified PSMs")
+    parser.add_argument('--plot-mode', choices=PLOT_MODES, default='auto',
+                        help="RT vs m/z as scatter, density image, or density above a point count (auto)")
+    args = parser.parse_args()
+
+    samples = read_manifest(args.manifest)
+    start = time.perf_counter()
+    failed = write_reports(samples, {'fdr': args.fdr, 'plot_mode': args.plot_mode}, workers=args.workers)
+    print(f"{len(samples) - len(failed)} of {len(samples)} reports written in {time.perf_counter() - start:.1f} s")
+    for sample, error in failed.items():
+        print(f"{sample}: {error}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
@@ -1,96 +1,107 @@
-#python3 Compare.py 20240220/221020/MzML/*_features.csv 20240220/221020/DiaNN/*.stats.tsv 20240220/221020/*.mzidsummary.txt AnalysisReport.pdf
-import pandas as pd
+#python3 Compare.py [--workers N] 20240220/221020/MzML/*_features.csv [20240220/221020/MzML/*.acqmode.tsv] 20240220/221020/DiaNN/*.stats.tsv 20240220/221020/*.mzidsummary.txt AnalysisReport.pdf
+#python3 Compare.py --db metrics.sqlite [--project RawFiles/Test/] AnalysisReport.pdf   (samples stored with metrics_store.py)
+#python3 Compare.py --db metrics.sqlite --trend-outliers outliers.tsv AnalysisReport.pdf   (adds the QC trend page)
+import argparse
 import os
-import sys
-import csv
-import re
 import numpy as np
 import matplotlib.pyplot as plt
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-
-# Common setup
-script_dir = os.path.dirname(os.path.abspath(__file__))
-plot_filename = os.path.join(script_dir, 'plot1.png')
-plot2_filename = os.path.join(script_dir, 'plot2.png')
-Report = sys.argv[-1]
-
-scannumbers = {}
-precursors_identified_counts = {}
-ng_regex = re.compile(r"\/([^\/]*?)(\d+_)?([\d]+ng)(.*?)(_\d)?\.")
-
-# File grouping with added flexibility for both file types
-group1_files = [f for f in sys.argv[1:] if '.features.csv' in f]
-group2_files = [f for f in sys.argv[1:] if '.stats.tsv' in f or '.mzidsummary.txt' in f]
-
-#################### Find the type of inputfile 
-def analyze_isolation_window_target(file):
-    # Load the CSV file
-    df = pd.read_csv(file)
-    
-    # Select the "Isolation Window Target" column, replace 'N/A' with np.nan, and convert to float
-    column = df['Isolation Window Target'].replace('N/A', np.nan).astype(float)
-     
-    # Calculate the number of unique numeric values
-    unique_numeric_values = column.dropna().unique()
-    
-    # It is DIA if the pattern repeated at least 50 times
-    if len(unique_numeric_values) < len(column.dropna()) / 50:
-        return "DIA"
-    else:
-        return "DDA"
-
-
-def create_keyname(file, no_match_name, filetype):
-    ng_match = ng_regex.search(file)
-    if ng_match is None:
-        print("No match", file)
-        keyname = no_match_name
-    else:
-        #print(ng_match.group(1), ng_match.group(2), ng_match.group(3), ng_match.group(4))
-        ng_part1 = ng_match.group(2)
-        ng_part2 = ng_match.group(3)
-
-        if ng_part1 is not None and 1 < len(ng_part1) <= 4:
-            ng_candidate = ng_part1.replace('_', '.') + ng_part2
-            nanogram_number = float(ng_candidate.replace('ng', ''))
-        elif ng_part2.startswith("0"):
-            ng_candidate = '0.' + ng_part2[1:]
-            nanogram_number = float(ng_candidate.replace('ng', ''))
-        elif ng_part1 is not None:
-            ng_candidate = ng_part1 + "_" + ng_part2
-            nanogram_number = float(ng_part2.replace('ng', ''))
+from acquisition_mode import SIDECAR_SUFFIX
+from metrics_store import load_metrics, project_id
+from sample_metrics import SCAN_TABLE_SUFFIXES, extract_metrics, identification_metrics, sample_name, scan_table_metrics
+from report_plots import png_image, render_pngs
+import qc_trend
+import profiling
+
+# Width of the bars; the draw functions run in the plot worker processes, so they live at module level
+bar_width = 0.35
+
+def draw_scan_counts(sorted_ng_labels, sorted_ms1_counts, sorted_msms_counts):
+    x = np.arange(len(sorted_ng_labels))  # the label locations, now sorted
+    ax = plt.gca()
+    bars1 = ax.bar(x - bar_width/2, sorted_ms1_counts, bar_width, label='MS1', color='yellow')
+    bars2 = ax.bar(x + bar_width/2, sorted_msms_counts, bar_width, label='MS2', color='blue')
+
+    # Update text for labels, title, and custom x-axis tick labels to use sorted NG values
+    ax.set_xlabel('Samples')
+    ax.set_ylabel('Average Count')
+    ax.set_title('Average MS1 and MSMS Spectra for each sample')
+    ax.set_xticks(x)
+    ax.set_xticklabels(sorted_ng_labels, rotation=45, ha='right')  # Use sorted labels
+    ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    plt.tight_layout()
+
+
+def draw_precursor_counts(sorted_ng_keys, sorted_avg_precursors_counts):
+    x = np.arange(len(sorted_ng_keys))  # the label locations
+    ax = plt.gca()
+    bars1 = ax.bar(x - bar_width/2, sorted_avg_precursors_counts, bar_width, label='precursors\ncounts', color='green')
+
+    # Add some text for labels, title, and custom x-axis tick labels, etc.
+    ax.set_xlabel('Samples')
+    ax.set_ylabel('Identified Precursors')
+    ax.set_title('Identified Precursors comparison between samples')
+    ax.set_xticks(x)
+    ax.set_xticklabels(sorted_ng_keys, rotation=45, ha='right')
+    ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    plt.tight_layout()
+
+
+if __name__ == "__main__":
+    # Common setup
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help="input files followed by the output PDF, only the PDF with --db")
+    parser.add_argument('--db', help="metrics store (metrics_store.py) to read the per-sample metrics from instead of the files")
+    parser.add_argument('--project', help="with --db, only the samples of this .raw folder (default: all stored samples)")
+    parser.add_argument('--trend-outliers', help="add a QC trend page over all runs and write the outlier runs to this TSV")
+    parser.add_argument('--trend-window', type=int, default=qc_trend.WINDOW, help="runs in the trailing baseline of the trends")
+    parser.add_argument('--trend-threshold', type=float, default=qc_trend.Z_THRESHOLD, help="robust z-score above which a run is an outlier")
+    parser.add_argument('--workers', type=int, help="processes reading the per-sample files (default: all CPUs)")
+    args = parser.parse_args()
+    input_files = args.files[:-1]
+    Report = args.files[-1]
+    profiling.start('Compare.py', Report)
+
+    scannumbers = {}
+    precursors_identified_counts = {}
+
+    # File grouping with added flexibility for both file types
+    group1_files = [f for f in input_files if f.endswith(SCAN_TABLE_SUFFIXES)]
+    group2_files = [f for f in input_files if '.stats.tsv' in f or '.mzidsummary.txt' in f]
+
+    # Acquisition mode sidecars ({sample}.acqmode.tsv) written once per sample by DIA-or-DDA.py --sidecar
+    acqmode_files = {os.path.basename(f)[:-len(SIDECAR_SUFFIX)]: f for f in input_files if f.endswith(SIDECAR_SUFFIX)}
+
+    def create_keyname(metrics):
+        # Sample key and nanogram load from the metrics, with the mode added when DIA and DDA are compared
+        keyname = metrics['key']
+        if len(unique_filetypes) > 1:
+            keyname += " " + metrics['mode']
+        return (keyname, metrics['nanogram'])
+
+
+    #################### Per-sample metrics, one query on the metrics store or one projected read per file, in parallel
+    with profiling.section('load'):
+        if args.db:
+            scan_metrics, identified_metrics = load_metrics(args.db, project_id(args.project) if args.project else None)
         else:
-            ng_candidate = ng_part2
-            nanogram_number = float(ng_part2.replace('ng', ''))
-
-        keyname = ng_match.group(1) + ng_candidate + ng_match.group(4)
-
-     # Remove 'DIA' or 'DDA' from keyname (if not part of the intentional filetype addition)
-    keyname = re.sub(r'(dia|dda)', '', keyname, flags=re.IGNORECASE)
-    if len(unique_filetypes) > 1:
-        keyname += " " + filetype
-    return (keyname, nanogram_number)
-unique_filetypes = set([analyze_isolation_window_target(inputfile) for inputfile in group1_files])
-
-######################## Process Group 1 files (CSV)
-nanogram_numbers = {}
-for inputfile in group1_files:
-    filetype = analyze_isolation_window_target(inputfile)
-    scan_number_MSMS = 0
-    scan_number_MS1 = 0
-
-    with open(inputfile) as file:
-        csv_reader = csv.DictReader(file)  # Use DictReader to access columns by header
-        for row in csv_reader:
-            # Check and count non-'N/A' values for 'Precursor Ion m/z'
-            if row.get('Precursor Ion m/z') and row['Precursor Ion m/z'] != 'N/A':
-                scan_number_MSMS += 1
-            # Check and count non-'N/A' values for 'MS1 Base Peak m/z'
-            if row.get('MS1 Base Peak m/z') and row['MS1 Base Peak m/z'] != 'N/A':
-                scan_number_MS1 += 1
-        keyname, nanogram_number = create_keyname(inputfile, os.path.basename(inputfile).replace(".features.csv", ""), filetype)
+            # The mode comes from the sample's sidecar when given, the scan table is only classified without one
+            scan_metrics = extract_metrics(scan_table_metrics,
+                                           [(inputfile, acqmode_files.get(sample_name(inputfile))) for inputfile in group1_files],
+                                           args.workers)
+            identified_metrics = extract_metrics(identification_metrics, [(inputfile,) for inputfile in group2_files], args.workers)
+    unique_filetypes = set(metrics['mode'] for metrics in scan_metrics)
+
+    ######################## Process Group 1 files (CSV)
+    nanogram_numbers = {}
+    for metrics in scan_metrics:
+        inputfile = metrics['file']
+        filetype = metrics['mode']
+        scan_number_MS1 = metrics['ms1_scans']
+        scan_number_MSMS = metrics['ms2_scans']
+
+        keyname, nanogram_number = create_keyname(metrics)
         nanogram_numbers[keyname] = nanogram_number        
         # Use keyname for dictionary operations
         if keyname not in scannumbers:
@@ -99,129 +110,99 @@ for inputfile in group1_files:
         scannumbers[keyname][1].append(scan_number_MS1)
 
 
-# Print each key and value in the desired format
-for key, (msms, ms1) in scannumbers.items():
-    msms = np.average(msms)
-    ms1 = np.average(ms1)
+    # Print each key and value in the desired format
+    for key, (msms, ms1) in scannumbers.items():
+        msms = np.average(msms)
+        ms1 = np.average(ms1)
 
-# Prepare data for plotting
-ng_candidate_labels = list(scannumbers.keys())
+    # Prepare data for plotting
+    ng_candidate_labels = list(scannumbers.keys())
 
 
-# Define a sorting key function
-def ng_value_sort_key(keyname):
-    numeric_part = nanogram_numbers[keyname]
-    return numeric_part, keyname
-    
-# Assuming ng_value_sort_key function is already defined
-# Sort NG values for consistent order in plotting
-width = 0.35
-sorted_ng_labels = sorted(scannumbers.keys(), key=ng_value_sort_key)
-sorted_msms_counts = [np.mean(scannumbers[ng][0]) for ng in sorted_ng_labels]
-sorted_ms1_counts = [np.mean(scannumbers[ng][1]) for ng in sorted_ng_labels]
-
-x = np.arange(len(sorted_ng_labels))  # the label locations, now sorted
-
-fig, ax = plt.subplots()
-bars1 = ax.bar(x - width/2, sorted_ms1_counts, width, label='MS1', color='yellow')
-bars2 = ax.bar(x + width/2, sorted_msms_counts, width, label='MS2', color='blue')
-
-# Update text for labels, title, and custom x-axis tick labels to use sorted NG values
-ax.set_xlabel('Samples')
-ax.set_ylabel('Average Count')
-ax.set_title('Average MS1 and MSMS Spectra for each sample')
-ax.set_xticks(x)
-ax.set_xticklabels(sorted_ng_labels, rotation=45, ha='right')  # Use sorted labels
-ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
-
-
-plt.tight_layout()
-fig.savefig(plot_filename, bbox_inches='tight')
-
-
-######################### Process Group 2 files (.stats.tsv or .mzidsummary.txt)
-for inputfile in group2_files:
-    precursors_identified = -1  # Default to -1
-    ng_candidate = ''
-
-    # Check file type and process accordingly
-    if inputfile.endswith('.stats.tsv'):
-        with open(inputfile, newline='') as file:
-            tsv_reader = csv.DictReader(file, delimiter='\t')
-            for row in tsv_reader:
-                try:
-                    precursors_identified += int(row['Precursors.Identified'])
-                except ValueError:
-                    pass  # Handle non-integer values gracefully
-        filetype = 'DIA'
-    elif inputfile.endswith('.mzidsummary.txt'):
-        with open(inputfile, 'r') as file:
-            lines = file.readlines()
-            if len(lines) >= 2:
-                precursors_identified = int(lines[1].split()[0])
-        filetype = 'DDA'
-
-    keyname, nanogram_number = create_keyname(inputfile, os.path.basename(inputfile).replace('.stats.tsv', "").replace('.mzidsummary.txt', ""), filetype)
-    nanogram_numbers[keyname] = nanogram_number  
-    # Update the dictionary for precursors identified counts
-    if precursors_identified != -1:
-        if keyname not in precursors_identified_counts:
-            precursors_identified_counts[keyname] = []
-        precursors_identified_counts[keyname].append(precursors_identified)
-
-# Print each key and value in the desired format for the second group
-for key, precursors_counts in precursors_identified_counts.items():
-    avg_precursors_identified = np.average(precursors_counts)
-    print(f"{key}: {avg_precursors_identified}")
-
-
-ng_candidate_labels_group2 = list(precursors_identified_counts.keys())
-
-all_ng_candidate_labels = sorted(set(ng_candidate_labels + ng_candidate_labels_group2))
-
-avg_precursors_counts = [np.mean(counts) for counts in precursors_identified_counts.values()]
-
-# Define a sorting key function
-def ng_value_sort_key(keyname):
-    numeric_part = nanogram_numbers[keyname]
-    return numeric_part, keyname
+    # Define a sorting key function
+    def ng_value_sort_key(keyname):
+        numeric_part = nanogram_numbers[keyname]
+        return numeric_part, keyname
     
-# Sort NG values and ensure consistent order for plotting
-sorted_ng_keys = sorted(precursors_identified_counts.keys(), key=ng_value_sort_key)
-sorted_avg_precursors_counts = [np.mean(precursors_identified_counts[ng]) for ng in sorted_ng_keys]
+    # Assuming ng_value_sort_key function is already defined
+    # Sort NG values for consistent order in plotting
+    sorted_ng_labels = sorted(scannumbers.keys(), key=ng_value_sort_key)
+    sorted_msms_counts = [np.mean(scannumbers[ng][0]) for ng in sorted_ng_labels]
+    sorted_ms1_counts = [np.mean(scannumbers[ng][1]) for ng in sorted_ng_labels]
 
-x = np.arange(len(sorted_ng_keys))  # the label locations
-width = 0.35  # the width of the bars
 
-fig2, ax = plt.subplots()
-bars1 = ax.bar(x - width/2, sorted_avg_precursors_counts, width, label='precursors\ncounts', color='green')
+    ######################### Process Group 2 files (.stats.tsv or .mzidsummary.txt)
+    for metrics in identified_metrics:
+        inputfile = metrics['file']
+        precursors_identified = metrics['precursors_identified']
+        filetype = metrics['mode']
 
-# Add some text for labels, title, and custom x-axis tick labels, etc.
-ax.set_xlabel('Samples')
-ax.set_ylabel('Identified Precursors')
-ax.set_title('Identified Precursors comparison between samples')
-ax.set_xticks(x)
-ax.set_xticklabels(sorted_ng_keys, rotation=45, ha='right')
-ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
+        keyname, nanogram_number = create_keyname(metrics)
+        nanogram_numbers[keyname] = nanogram_number  
+        # Update the dictionary for precursors identified counts
+        if precursors_identified != -1:
+            if keyname not in precursors_identified_counts:
+                precursors_identified_counts[keyname] = []
+            precursors_identified_counts[keyname].append(precursors_identified)
 
+    # Print each key and value in the desired format for the second group
+    for key, precursors_counts in precursors_identified_counts.items():
+        avg_precursors_identified = np.average(precursors_counts)
+        print(f"{key}: {avg_precursors_identified}")
 
-plt.tight_layout()
 
-fig.savefig(plot_filename, bbox_inches='tight')
-fig2.savefig(plot2_filename, bbox_inches='tight')
+    ng_candidate_labels_group2 = list(precursors_identified_counts.keys())
 
+    all_ng_candidate_labels = sorted(set(ng_candidate_labels + ng_candidate_labels_group2))
 
-#Create the Report
-c = canvas.Canvas(Report, pagesize=landscape(A4))
-width, height = landscape(A4) 
-# Load the plot image
-plot_image = ImageReader(plot_filename)
-plot2_image = ImageReader(plot2_filename)
+    avg_precursors_counts = [np.mean(counts) for counts in precursors_identified_counts.values()]
 
-# Draw the images onto the PDF
-c.drawImage(plot_image, x=0, y=0, width=width, preserveAspectRatio=True, anchor='c')
-c.showPage()  # Finish the first page
-c.drawImage(plot2_image, x=0, y=0, width=width, preserveAspectRatio=True, anchor='c')
-
-# Save the PDF
-c.save()
\ No newline at end of file
+    # Define a sorting key function
+    def ng_value_sort_key(keyname):
+        numeric_part = nanogram_numbers[keyname]
+        return numeric_part, keyname
+    
+    # Sort NG values and ensure consistent order for plotting
+    sorted_ng_keys = sorted(precursors_identified_counts.keys(), key=ng_value_sort_key)
+    sorted_avg_precursors_counts = [np.mean(precursors_identified_counts[ng]) for ng in sorted_ng_keys]
+
+
+    plot_jobs = [
+        (draw_scan_counts, (sorted_ng_labels, sorted_ms1_counts, sorted_msms_counts), {'bbox_inches': 'tight'}),
+        (draw_precursor_counts, (sorted_ng_keys, sorted_avg_precursors_counts), {'bbox_inches': 'tight'}),
+    ]
+
+    ######################### QC trends and outliers over all runs, in run order
+    if args.trend_outliers:
+        with profiling.section('trend'):
+            runs = qc_trend.add_baselines(qc_trend.run_table(scan_metrics, identified_metrics), args.trend_window)
+            outliers = qc_trend.find_outliers(runs, args.trend_threshold)
+            qc_trend.write_outliers(outliers, args.trend_outliers)
+        print(f"{outliers['sample'].nunique()} of {len(runs)} runs flagged, written to {args.trend_outliers}")
+        plot_jobs.append((qc_trend.draw_trends, (runs, args.trend_window, args.trend_threshold), {'dpi': 150}))
+
+    # Render the plots in parallel, as PNG bytes in memory, so concurrent Compare jobs cannot overwrite each other's images
+    with profiling.section('plot'):
+        plot_pngs = render_pngs(plot_jobs, workers=len(plot_jobs))
+
+
+    with profiling.section('pdf'):
+        #Create the Report
+        c = canvas.Canvas(Report, pagesize=landscape(A4))
+        width, height = landscape(A4) 
+        # Load the plot image
+        plot_image = png_image(plot_pngs[0])
+        plot2_image = png_image(plot_pngs[1])
+
+        # Draw the images onto the PDF
+        c.drawImage(plot_image, x=0, y=0, width=width, preserveAspectRatio=True, anchor='c')
+        c.showPage()  # Finish the first page
+        c.drawImage(plot2_image, x=0, y=0, width=width, preserveAspectRatio=True, anchor='c')
+        if args.trend_outliers:
+            # The trend page is portrait, it holds one panel per metric
+            c.showPage()
+            c.setPageSize(A4)
+            c.drawImage(png_image(plot_pngs[2]), x=0, y=0, width=A4[0], height=A4[1], preserveAspectRatio=True, anchor='c')
+
+        # Save the PDF
+        c.save()
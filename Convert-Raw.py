@@ -0,0 +1,295 @@
+'''
+python3 Convert-Raw.py [--config config.yaml | --settings JSON] [--pool N] [--msconvert-args="--gzip"] RawFiles/a.raw [RawFiles/b.raw ...]
+python3 Convert-Raw.py [--config config.yaml | --settings JSON] --stop-slots
+
+Converts .raw files to mzML (peak picking, demultiplexing when it works) with a pool
+of warm msconvert workers. A worker is started once per pool slot (msconvert_start,
+e.g. a detached container that keeps running) and reused by every later conversion,
+so container and Wine start-up are paid once per slot, not once per file. The files
+given on one command line are split over the slots and each slot converts its share
+in a single msconvert call. The workflow runs one job, and so one file, per call: there
+only the warm slots are shared; a backlog is converted in batches by calling this
+script with all its files. Slots are claimed with a lock file, so at most msconvert_pool_size
+conversions run at the same time, also across concurrent Snakemake jobs. A worker
+keeps the raw and mzML folders it was started with (e.g. the container's mounts), so
+slots belong to a project: {project} in the msconvert_* commands, and the lock file
+names, is a hash of the two folders, which keeps the containers of two projects on one
+host apart. --stop-slots stops the running workers of the project with msconvert_stop,
+each once its slot is free; the workflow does this when it finishes or fails.
+
+Every attempt is recorded in the ledger (msconvert_ledger.tsv in path_to_mzml) with
+the raw file's size and mtime. A file whose demultiplex attempt failed is converted
+once more without that filter, and from then on converted without it straight away
+(msconvert_demultiplex "auto"; "always" ignores the ledger, "never" skips the filter).
+A conversion failed when msconvert exits non-zero for a single file, or, in a call of
+many files, when the file's mzML does not end with its closing tag (cut off); the
+output is then removed.
+Exits 1 if any file could not be converted.
+
+The msconvert_* settings, path_to_samples and path_to_mzml are read from the workflow
+configuration file, or given as a JSON object with --settings, which is how the
+workflow passes its own configuration (with any --config overrides). A slot whose
+converter cannot be started fails its files, the other slots go on.
+The converter command is configurable; benchmarks/fake_msconvert.py is a local
+stand-in for testing without Docker or Wine.
+'''
+import argparse
+import csv
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+
+PEAK_PICKING = ['--filter', 'peakPicking true 1-']
+DEMULTIPLEX = ['--filter', 'demultiplex']
+LEDGER_NAME = 'msconvert_ledger.tsv'
+LEDGER_COLUMNS = ['sample', 'raw_size', 'raw_mtime_ns', 'filters', 'outcome', 'seconds', 'finished']
+
+
+def log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+
+def raw_signature(raw_file):
+    stat = os.stat(raw_file)
+    return str(stat.st_size), str(stat.st_mtime_ns)
+
+
+def sample_of(raw_file):
+    return os.path.basename(raw_file)[:-len('.raw')]
+
+
+class Ledger:
+    """Append-only TSV of conversion attempts, shared by concurrent conversions."""
+    def __init__(self, path):
+        self.path = path
+
+    def failed_demultiplex(self):
+        """(sample, raw_size, raw_mtime_ns) of the files whose demultiplex conversion failed."""
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline='') as file:
+            return {(row['sample'], row['raw_size'], row['raw_mtime_ns']) for row in csv.DictReader(file, delimiter='\t')
+                    if row['filters'] == 'demultiplex' and row['outcome'] == 'failed'}
+
+    def record(self, rows):
+        with open(self.path, 'a', newline='') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            writer = csv.DictWriter(file, LEDGER_COLUMNS, delimiter='\t')
+            if file.tell() == 0:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+class Slot:
+    """One warm converter worker, held exclusively through a lock file while converting."""
+    def __init__(self, settings, number, lock_file):
+        self.settings = settings
+        self.number = number
+        self.lock_file = lock_file
+
+    def format(self, template):
+        return template.format(slot=self.number, project=self.settings['project'], raw_dir=self.settings['raw_dir'],
+                               mzml_dir=self.settings['mzml_dir'])
+
+    def ensure_started(self):
+        start = self.settings['msconvert_start']
+        if not start:
+            return
+        if subprocess.run(self.format(self.settings['msconvert_check']), shell=True).returncode != 0:
+            log(f"Starting converter slot {self.number}")
+            subprocess.run(self.format(start), shell=True, check=True, stdout=subprocess.DEVNULL)
+
+    def stop(self):
+        """Stop the worker of this slot if it is running; False if stopping it failed."""
+        stop = self.settings['msconvert_stop']
+        if not (stop and self.settings['msconvert_start']) \
+                or subprocess.run(self.format(self.settings['msconvert_check']), shell=True).returncode != 0:
+            return True
+        log(f"Stopping converter slot {self.number}")
+        return subprocess.run(self.format(stop), shell=True, stdout=subprocess.DEVNULL).returncode == 0
+
+    def convert(self, raw_files, filters, msconvert_args):
+        """One msconvert call for all the files; returns the files whose mzML was written."""
+        in_dir = self.settings['msconvert_in_dir']
+        out_dir = self.settings['msconvert_out_dir'] or self.settings['mzml_dir']
+        outputs = {raw_file: mzml_output(raw_file, self.settings['mzml_dir'], msconvert_args) for raw_file in raw_files}
+        for output in outputs.values():
+            if os.path.exists(output):
+                os.remove(output)  # Left by an earlier failed attempt
+        command = (shlex.split(self.format(self.settings['msconvert_command'])) + ['-o', out_dir, '-v']
+                   + msconvert_args + PEAK_PICKING + (DEMULTIPLEX if filters == 'demultiplex' else [])
+                   + [os.path.join(in_dir, os.path.basename(raw_file)) if in_dir else os.path.abspath(raw_file)
+                      for raw_file in raw_files])
+        returncode = subprocess.run(command).returncode
+        if self.settings['msconvert_after']:
+            subprocess.run(self.format(self.settings['msconvert_after']), shell=True)
+        converted = []
+        for raw_file, output in outputs.items():
+            # A call of one file fails as a whole. msconvert goes on after a failing file and then exits 1,
+            # so the outputs of a call of many files are checked one by one, which catches a truncated file
+            if (returncode == 0 or len(outputs) > 1) and os.path.exists(output) and is_complete_mzml(output):
+                converted.append(raw_file)
+            elif os.path.exists(output):
+                os.remove(output)
+        return converted
+
+    def release(self):
+        self.lock_file.close()
+
+
+def is_complete_mzml(path, tail_bytes=4096):
+    """Whether the (gzipped) mzML ends with its closing tag, i.e. was not cut off."""
+    tail = b''
+    try:
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as file:
+            if path.endswith('.gz'):
+                while chunk := file.read(1 << 20):  # A gzip stream is only read from the start
+                    tail = (tail + chunk)[-tail_bytes:]
+            else:
+                file.seek(max(os.path.getsize(path) - tail_bytes, 0))
+                tail = file.read()
+    except (OSError, EOFError):
+        return False  # Also a truncated gzip stream
+    return tail.rstrip().endswith((b'</indexedmzML>', b'</mzML>'))
+
+
+def mzml_output(raw_file, mzml_dir, msconvert_args):
+    return os.path.join(mzml_dir, sample_of(raw_file) + '.mzML' + ('.gz' if '--gzip' in msconvert_args else ''))
+
+
+def slot_lock(settings, number):
+    return open(os.path.join(settings['mzml_dir'], f".msconvert-{settings['project']}-slot-{number}.lock"), 'w')
+
+
+def claim_slot(settings, poll_seconds=1.0):
+    """Lock the first free slot, waiting until one is free."""
+    while True:
+        for number in range(settings['msconvert_pool_size']):
+            lock_file = slot_lock(settings, number)
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            return Slot(settings, number, lock_file)
+        time.sleep(poll_seconds)
+
+
+def stop_slots(settings):
+    """Stop the running workers of every slot, waiting for conversions in progress; returns the slots that failed."""
+    failed = []
+    for number in range(settings['msconvert_pool_size']):
+        lock_file = slot_lock(settings, number)
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        slot = Slot(settings, number, lock_file)
+        try:
+            if not slot.stop():
+                failed.append(number)
+        finally:
+            slot.release()
+    return failed
+
+
+def convert_share(settings, ledger, raw_files, skip_demultiplex, msconvert_args):
+    """Convert one slot's share of the batch: demultiplex first where it may work, then without."""
+    slot = claim_slot(settings)
+    try:
+        try:
+            slot.ensure_started()
+        except subprocess.CalledProcessError as error:
+            log(f"Slot {slot.number}: could not start the converter (exit code {error.returncode}), "
+                f"{len(raw_files)} files not converted")
+            return []
+        attempts = [('demultiplex', [f for f in raw_files if f not in skip_demultiplex]),
+                    ('peakPicking', [f for f in raw_files if f in skip_demultiplex])]
+        converted = []
+        while attempts:
+            filters, files = attempts.pop(0)
+            if not files:
+                continue
+            start = time.perf_counter()
+            done = slot.convert(files, filters, msconvert_args)
+            seconds = (time.perf_counter() - start) / len(files)
+            ledger.record([dict(zip(LEDGER_COLUMNS, (sample_of(f),) + raw_signature(f) + (
+                filters, 'ok' if f in done else 'failed', f"{seconds:.1f}", time.strftime('%Y-%m-%dT%H:%M:%S'))))
+                for f in files])
+            converted += done
+            failed = [f for f in files if f not in done]
+            if filters == 'demultiplex' and failed:
+                log(f"Slot {slot.number}: demultiplex failed for {len(failed)} files, converting them without it")
+                attempts.append(('peakPicking', failed))
+        return converted
+    finally:
+        slot.release()
+
+
+def convert(raw_files, settings, msconvert_args=(), pool_size=None):
+    """Convert the raw files with the warm converter pool; returns the files that failed."""
+    msconvert_args = list(msconvert_args)
+    ledger = Ledger(os.path.join(settings['mzml_dir'], LEDGER_NAME))
+    mode = settings['msconvert_demultiplex']
+    if mode == 'never':
+        skip_demultiplex = set(raw_files)
+    elif mode == 'always':
+        skip_demultiplex = set()
+    else:
+        failed_before = ledger.failed_demultiplex()
+        skip_demultiplex = {f for f in raw_files if (sample_of(f),) + raw_signature(f) in failed_before}
+    shares = min(pool_size or settings['msconvert_pool_size'], len(raw_files))
+    batches = [raw_files[i::shares] for i in range(shares)]
+    with ThreadPoolExecutor(shares) as pool:
+        converted = [f for done in pool.map(lambda batch: convert_share(settings, ledger, batch, skip_demultiplex,
+                                                                       msconvert_args), batches) for f in done]
+    return [f for f in raw_files if f not in converted]
+
+
+def read_settings(config):
+    """Converter settings from the workflow configuration (a dict)."""
+    settings = {key: value for key, value in config.items() if key.startswith('msconvert_')}
+    settings['raw_dir'] = os.path.abspath(config['path_to_samples'])
+    settings['mzml_dir'] = os.path.abspath(config['path_to_mzml'])
+    # Slots (warm workers with their folders) of this project, see the module docstring
+    folders = f"{os.path.realpath(settings['raw_dir'])}\0{os.path.realpath(settings['mzml_dir'])}"
+    settings['project'] = hashlib.sha256(folders.encode()).hexdigest()[:10]
+    return settings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert .raw files to mzML with a pool of warm msconvert workers.")
+    parser.add_argument('raw_files', nargs='*')
+    parser.add_argument('--config', default='config.yaml', help="workflow configuration with the msconvert_* settings")
+    parser.add_argument('--settings', help="the msconvert_*, path_to_samples and path_to_mzml settings as a JSON object, "
+                                           "instead of reading --config")
+    parser.add_argument('--pool', type=int, help="slots used for this batch (default: msconvert_pool_size)")
+    parser.add_argument('--msconvert-args', default='', help="extra msconvert options, e.g. --msconvert-args=\"--gzip --numpressAll\"")
+    parser.add_argument('--stop-slots', action='store_true', help="stop the running converter workers of the project")
+    args = parser.parse_args()
+    if not args.raw_files and not args.stop_slots:
+        parser.error("no raw files given")
+
+    if args.settings:
+        config = json.loads(args.settings)
+    else:
+        with open(args.config) as file:
+            config = yaml.safe_load(file)
+    settings = read_settings(config)
+    os.makedirs(settings['mzml_dir'], exist_ok=True)
+    if args.stop_slots:
+        failed_slots = stop_slots(settings)
+        for number in failed_slots:
+            print(f"Could not stop converter slot {number}", file=sys.stderr)
+        sys.exit(1 if failed_slots else 0)
+    start = time.perf_counter()
+    failed = convert(args.raw_files, settings, shlex.split(args.msconvert_args), args.pool)
+    log(f"{len(args.raw_files) - len(failed)} of {len(args.raw_files)} files converted in {time.perf_counter() - start:.1f} s")
+    for raw_file in failed:
+        print(f"Conversion failed: {raw_file}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
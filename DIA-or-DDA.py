@@ -1,37 +1,59 @@
-import pandas as pd
-import numpy as np
+'''
+python3 DIA-or-DDA.py sample.mzML|sample.features.parquet [...]   exit 0 if all samples are DIA, 1 otherwise
+python3 DIA-or-DDA.py --sidecar sample.acqmode.tsv sample.mzML
+
+Inputs can be mzML (plain or .gz) or per-scan tables. The isolation window targets are
+streamed and reading stops once the answer is settled (see acquisition_mode.classify_stream);
+--no-early-exit reads the whole file.
+With --sidecar the mode, number of isolation windows and demultiplexing flag are
+written to a small per-sample file that the pipeline reads instead of re-running
+this script. Sidecar files can also be given as input and are read, not recomputed.
+'''
+import argparse
 import sys
+from acquisition_mode import SIDECAR_SUFFIX, classify_file, read_sidecar, write_sidecar
+import profiling
+
+def analyze_isolation_window_target(file_path, early_exit=True):
+    if file_path.endswith(SIDECAR_SUFFIX):
+        result = read_sidecar(file_path)
+    else:
+        result = classify_file(file_path, early_exit)
 
-def analyze_isolation_window_target(file_path):
-    # Load the CSV file
-    df = pd.read_csv(file_path)
-    
-    # Select the "Isolation Window Target" column, replace 'N/A' with np.nan, and convert to float
-    column = df['Isolation Window Target'].replace('N/A', np.nan).astype(float)
-    
     # Check if there are enough numeric values
-    if column.isna().all():
+    if result['mode'] is None:
         print("The column contains only 'N/A' values or is empty.")
         return
-    
-    # Calculate the number of unique numeric values
-    unique_numeric_values = column.dropna().unique()
-    
-    # It is DIA if the pattern repeated at least 50 times
-    if len(unique_numeric_values) < len(column.dropna()) / 50:
-        print("DIA file.")
-        return "DIA file."
-    else:
-        print("DDA file.")
-        return "DDA file."
+
+    print(f"{result['mode']} file.")
+    return f"{result['mode']} file."
 
 
 if __name__ == "__main__":
-    files = sys.argv[1:]  # Get all provided file paths
+    parser = argparse.ArgumentParser(description="Detect whether samples are DIA or DDA.")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--sidecar', help="write the acquisition mode of the single input to this file")
+    parser.add_argument('--no-early-exit', dest='early_exit', action='store_false',
+                        help="read every scan instead of stopping once the mode is settled")
+    args = parser.parse_args()
+    profiling.start('DIA-or-DDA.py', args.files[0])
+
+    if args.sidecar:
+        if len(args.files) != 1:
+            parser.error("--sidecar takes exactly one input file")
+        with profiling.section('classify'):
+            result = classify_file(args.files[0], args.early_exit)
+        write_sidecar(args.sidecar, result)
+        print(f"{result['mode'] or 'DDA'} file, {result['isolation_windows']} isolation windows "
+              f"({result['scans_read']} MS2 scans read{', stopped early' if result['stopped_early'] else ''})")
+        sys.exit(0)
+
+    files = args.files  # Get all provided file paths
     dia_files_count = 0
 
     for file_path in files:
-        result = analyze_isolation_window_target(file_path)
+        with profiling.section('classify'):
+            result = analyze_isolation_window_target(file_path, args.early_exit)
         if result == "DIA file.":
             dia_files_count += 1
 
@@ -42,4 +64,3 @@ if __name__ == "__main__":
     else:
         print("DDA file.")
         sys.exit(1)
-    
@@ -0,0 +1,153 @@
+'''
+python3 Performance-Report.py [--db metrics.sqlite [--project RawFiles/Test/]] report/telemetry/ Performance.pdf performance.tsv
+
+Pipeline performance page from the per-job records of stage_telemetry.py. The table
+written to performance.tsv has one row per job, with the sample's spectrum count
+(MS1 + MS2 scans) from the metrics store when --db is given. Jobs whose outputs came
+from the result cache (cache_hit) are listed in the table and counted, but left out of
+the summary and the plots, as their times say nothing about the stage. The PDF has
+- a summary per rule: jobs, total and median wall time, CPU time, CPU use per wall
+  second (parallelism reached), peak RSS and its share of the requested mem_mb, bytes
+  read and written, and wall seconds per million spectra;
+- total wall and CPU time per rule, largest first, i.e. the bottleneck stages;
+- wall time and peak RSS of every job against its spectrum count (input size without
+  --db), log scales, one colour per rule, to show how each stage scales.
+'''
+import argparse
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfgen import canvas
+from metrics_store import load_metrics, project_id
+from report_plots import png_image, render_pngs
+from stage_telemetry import load_records
+
+JOB_COLUMNS = ['rule', 'sample', 'host', 'started', 'exit_code', 'cache_hit', 'threads', 'mem_mb_requested', 'wall_s', 'user_s',
+               'system_s', 'cpu_s', 'cpu_per_wall', 'max_rss_mb', 'input_bytes', 'spectra', 'read_bytes',
+               'write_bytes', 'disk_read_bytes', 'disk_write_bytes']
+
+
+def job_table(records, scan_metrics=()):
+    jobs = pd.DataFrame(records)
+    # Records written before cache hits were recorded count as computed
+    jobs['cache_hit'] = jobs['cache_hit'].fillna(False).astype(bool) if 'cache_hit' in jobs else False
+    jobs['cpu_s'] = (jobs['user_s'] + jobs['system_s']).round(3)
+    jobs['cpu_per_wall'] = (jobs['cpu_s'] / jobs['wall_s'].where(jobs['wall_s'] > 0)).round(2)
+    spectra = {metrics['sample']: metrics['ms1_scans'] + metrics['ms2_scans'] for metrics in scan_metrics}
+    jobs['spectra'] = jobs['sample'].map(spectra)
+    return jobs.reindex(columns=JOB_COLUMNS).sort_values(['rule', 'sample'], na_position='first', ignore_index=True)
+
+
+def rule_summary(jobs):
+    """One row per rule, ordered by total wall time."""
+    memory_share = jobs['max_rss_mb'] / jobs['mem_mb_requested']
+    per_million = jobs['wall_s'] / jobs['spectra'] * 1e6
+    grouped = jobs.assign(memory_share=memory_share, per_million=per_million).groupby('rule')
+    summary = pd.DataFrame({
+        'jobs': grouped.size(),
+        'wall_h': grouped['wall_s'].sum() / 3600,
+        'median_wall_s': grouped['wall_s'].median(),
+        'cpu_h': grouped['cpu_s'].sum() / 3600,
+        'cpu_per_wall': grouped['cpu_per_wall'].median(),
+        'max_rss_mb': grouped['max_rss_mb'].max(),
+        'rss_of_requested': grouped['memory_share'].max(),
+        'read_gb': grouped['read_bytes'].sum() / 1e9,
+        'written_gb': grouped['write_bytes'].sum() / 1e9,
+        's_per_million_spectra': grouped['per_million'].median(),
+    })
+    return summary.sort_values('wall_h', ascending=False)
+
+
+def summary_lines(summary, jobs):
+    header = f"{'rule':<26}{'jobs':>5}{'wall h':>8}{'median s':>10}{'CPU h':>8}{'CPU/wall':>9}" \
+             f"{'max RSS MB':>11}{'of req.':>8}{'read GB':>9}{'written GB':>11}{'s/M spectra':>12}"
+    lines = [header]
+    for rule, row in summary.iterrows():
+        cells = [f"{rule[:25]:<26}{int(row['jobs']):>5}{row['wall_h']:>8.2f}{row['median_wall_s']:>10.1f}{row['cpu_h']:>8.2f}",
+                 f"{row['cpu_per_wall']:>9.2f}{row['max_rss_mb']:>11.0f}",
+                 f"{row['rss_of_requested']:>8.0%}" if pd.notna(row['rss_of_requested']) else f"{'':>8}",
+                 f"{row['read_gb']:>9.2f}{row['written_gb']:>11.2f}",
+                 f"{row['s_per_million_spectra']:>12.1f}" if pd.notna(row['s_per_million_spectra']) else ""]
+        lines.append(''.join(cells))
+    failed = int((jobs['exit_code'] != 0).sum())
+    hits = int(jobs['cache_hit'].sum())
+    hosts = ', '.join(sorted(jobs['host'].dropna().unique()))
+    lines += ["", f"{len(jobs)} jobs on {hosts}, {failed} failed, {hits} served from the result cache (not in the "
+                  f"summary). Total wall time {jobs['wall_s'].sum() / 3600:.2f} h, CPU time {jobs['cpu_s'].sum() / 3600:.2f} h."]
+    return lines
+
+
+def draw_bottlenecks(summary):
+    rules = summary.index[::-1]
+    y = np.arange(len(rules))
+    ax = plt.gca()
+    ax.barh(y + 0.2, summary['wall_h'][::-1], 0.4, label='Wall time', color='tab:blue')
+    ax.barh(y - 0.2, summary['cpu_h'][::-1], 0.4, label='CPU time', color='tab:orange')
+    ax.set_yticks(y)
+    ax.set_yticklabels(rules)
+    ax.set_xlabel('Hours, all jobs of the rule')
+    ax.set_title('Time per rule')
+    ax.legend(loc='lower right')
+    plt.tight_layout()
+
+
+def draw_scaling(jobs):
+    size_column, size_label = ('spectra', 'Spectra') if jobs['spectra'].notna().any() else ('input_bytes', 'Input bytes')
+    figure = plt.gcf()
+    figure.set_size_inches(14, 6)
+    for position, (value, label) in enumerate([('wall_s', 'Wall time (s)'), ('max_rss_mb', 'Peak RSS (MB)')], start=1):
+        ax = figure.add_subplot(1, 2, position)
+        for rule, group in jobs.groupby('rule'):
+            group = group[(group[size_column] > 0) & (group[value] > 0)]
+            if len(group):
+                ax.scatter(group[size_column], group[value], s=12, label=rule)
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel(size_label)
+        ax.set_ylabel(label)
+        ax.set_title(f"{label.split(' (')[0]} per job")
+        ax.grid(True, which='both', alpha=0.3)
+    if ax.get_legend_handles_labels()[0]:
+        ax.legend(loc='upper left', bbox_to_anchor=(1, 1), fontsize='small')
+    plt.tight_layout()
+
+
+def write_pdf(report_file, lines, pngs):
+    c = canvas.Canvas(report_file, pagesize=landscape(A4))
+    width, height = landscape(A4)
+    c.setFont('Helvetica-Bold', 14)
+    c.drawString(40, height - 40, "Pipeline performance")
+    c.setFont('Courier', 7.5)
+    current_y = height - 62
+    for line in lines:
+        c.drawString(40, current_y, line)
+        current_y -= 10
+    # The bottleneck chart under the table, the scaling plots on their own page
+    c.drawImage(png_image(pngs[0]), x=40, y=20, width=width - 80, height=current_y - 30, preserveAspectRatio=True, anchor='c')
+    c.showPage()
+    c.drawImage(png_image(pngs[1]), x=0, y=0, width=width, height=height, preserveAspectRatio=True, anchor='c')
+    c.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Performance page of the pipeline from the stage_telemetry.py records.")
+    parser.add_argument('telemetry_dir')
+    parser.add_argument('report', help="output PDF")
+    parser.add_argument('table', help="output TSV, one row per job")
+    parser.add_argument('--db', help="metrics store with the spectrum counts of the samples")
+    parser.add_argument('--project', help="with --db, the .raw folder of the samples (default: all stored samples)")
+    args = parser.parse_args()
+
+    records = load_records(args.telemetry_dir)
+    if not records:
+        parser.error(f"no telemetry records in {args.telemetry_dir}")
+    scan_metrics = load_metrics(args.db, project_id(args.project) if args.project else None)[0] if args.db else []
+    jobs = job_table(records, scan_metrics)
+    jobs.to_csv(args.table, sep='\t', index=False)
+    computed = jobs[~jobs['cache_hit']]
+    summary = rule_summary(computed)
+    pngs = render_pngs([(draw_bottlenecks, (summary,), {'dpi': 150}), (draw_scaling, (computed,), {'dpi': 120})], workers=2)
+    write_pdf(args.report, summary_lines(summary, jobs), pngs)
+    slowest = f", slowest: {summary.index[0]} ({summary['wall_h'].iloc[0]:.2f} h)" if len(summary) else ""
+    print(f"{len(jobs)} jobs, {len(computed)} computed, of {len(summary)} rules{slowest}")
@@ -0,0 +1,172 @@
+'''
+python3 Watch-Samples.py [--config config.yaml] [--snakefile snakefile] [--once]
+
+Long-running watcher for path_to_samples. A new .raw file is scheduled once its size
+and modification time have not changed for watch_settle_seconds, i.e. the instrument
+has finished writing it. Each ready sample gets its own Snakemake run with the
+sample's done flag (rule sample_done) as the only target, so only that sample's jobs
+are planned and checked; at most watch_max_parallel of these run at the same time,
+with watch_cores_per_sample cores each. Samples whose done flag exists are skipped,
+so the watcher can be restarted at any time.
+
+Comparison.pdf and QC_outliers.tsv are refreshed from the metrics store at most every
+watch_comparison_minutes, and only after new samples finished, and the finished
+samples flagged as outliers are printed. A failed sample is retried only when its
+.raw file changes. With --once the samples already present are processed and the
+watcher exits after the last comparison refresh. The warm msconvert slots are shared by
+the sample runs and stopped (Convert-Raw.py --stop-slots) when the watcher exits.
+'''
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import time
+import yaml
+
+RAW_SUFFIX = '.raw'
+
+
+def log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+
+def done_flag(config, sample):
+    # Output of rule sample_done in the snakefile
+    return config["path_to_report"] + "done/" + sample + ".done"
+
+
+def raw_files(directory):
+    """{sample: (size, mtime_ns)} of the .raw files in the directory."""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(RAW_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                files[entry.name[:-len(RAW_SUFFIX)]] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class Watcher:
+    def __init__(self, config, config_file, snakefile):
+        self.config = config
+        self.config_file = config_file
+        self.snakefile = snakefile
+        self.first_seen = {}  # sample: (size, mtime_ns, time the file was first seen with them)
+        self.failed = {}  # sample: (size, mtime_ns) of the .raw file that failed
+        self.running = {}  # sample: Popen
+        self.queue = []
+        self.finished = []  # samples done since the last comparison refresh
+        self.last_comparison = None
+
+    def poll_files(self):
+        """Queue the samples whose .raw file is complete and not processed yet."""
+        now = time.monotonic()
+        settle = self.config["watch_settle_seconds"]
+        for sample, signature in sorted(raw_files(self.config["path_to_samples"]).items()):
+            if sample in self.running or sample in self.queue or os.path.exists(done_flag(self.config, sample)):
+                continue
+            if self.failed.get(sample) == signature:
+                continue
+            seen = self.first_seen.get(sample)
+            if seen is None or seen[:2] != signature:
+                self.first_seen[sample] = signature + (now,)  # New or still being written
+            elif now - seen[2] >= settle:
+                del self.first_seen[sample]
+                self.failed.pop(sample, None)
+                self.queue.append(sample)
+                log(f"{sample}: size stable at {signature[0]} bytes, queued")
+
+    def start_samples(self):
+        while self.queue and len(self.running) < self.config["watch_max_parallel"]:
+            sample = self.queue.pop(0)
+            command = ["snakemake", "--snakefile", self.snakefile, "--configfile", self.config_file,
+                       "--cores", str(self.config["watch_cores_per_sample"]),
+                       "--config", "report_batch=False", "msconvert_stop=", "--", done_flag(self.config, sample)]
+            log_file = open(os.path.join(self.config["path_to_report"], "watch", sample + ".log"), "w")
+            self.running[sample] = (subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT),
+                                    log_file, time.monotonic())
+            log(f"{sample}: started ({len(self.running)} running, {len(self.queue)} queued)")
+
+    def reap_samples(self):
+        for sample, (process, log_file, start) in list(self.running.items()):
+            if process.poll() is None:
+                continue
+            log_file.close()
+            del self.running[sample]
+            if process.returncode == 0:
+                self.finished.append(sample)
+                log(f"{sample}: done in {(time.monotonic() - start) / 60:.1f} min")
+            else:
+                size_mtime = raw_files(self.config["path_to_samples"]).get(sample)
+                self.failed[sample] = size_mtime
+                log(f"{sample}: failed with exit code {process.returncode}, see {log_file.name}")
+
+    def refresh_comparison(self, force=False):
+        """Re-render the comparison from the metrics store when due and there are new samples."""
+        if not self.finished:
+            return
+        cadence = self.config["watch_comparison_minutes"] * 60
+        if not force and self.last_comparison is not None and time.monotonic() - self.last_comparison < cadence:
+            return
+        report = self.config["path_to_report"]
+        outliers = report + "QC_outliers.tsv"
+        # Same commands as rule ComparisonReport
+        prune = ["python3", "metrics_store.py", self.config["metrics_db"], "--project", self.config["path_to_samples"], "--prune"]
+        command = ["python3", "Compare.py", "--db", self.config["metrics_db"], "--project", self.config["path_to_samples"],
+                   "--trend-outliers", outliers, "--trend-window", str(self.config["trend_window"]),
+                   "--trend-threshold", str(self.config["trend_threshold"]), report + "Comparison.pdf"]
+        result = subprocess.run(prune, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode == 0:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        self.last_comparison = time.monotonic()
+        if result.returncode != 0:
+            log(f"Comparison refresh failed: {result.stderr.strip()}")
+            return
+        with open(outliers, newline='') as file:
+            flagged = {}
+            for row in csv.DictReader(file, delimiter='\t'):
+                flagged.setdefault(row['sample'], []).append(row['metric'])
+        for sample in self.finished:
+            verdict = "outlier in " + ", ".join(flagged[sample]) if sample in flagged else "within trend"
+            log(f"{sample}: {verdict}")
+        log(f"Comparison refreshed with {len(self.finished)} new samples")
+        self.finished = []
+
+    def stop_converters(self):
+        subprocess.run(["python3", "Convert-Raw.py", "--config", self.config_file, "--stop-slots"])
+
+    def run(self, once=False):
+        os.makedirs(os.path.join(self.config["path_to_report"], "watch"), exist_ok=True)
+        log(f"Watching {self.config['path_to_samples']} every {self.config['watch_poll_seconds']} s")
+        while True:
+            self.poll_files()
+            self.reap_samples()
+            self.start_samples()
+            self.refresh_comparison()
+            if once and not self.running and not self.queue and not self.first_seen:
+                self.refresh_comparison(force=True)
+                return 1 if self.failed else 0
+            time.sleep(self.config["watch_poll_seconds"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process new .raw files as soon as they are written.")
+    parser.add_argument('--config', default='config.yaml', help="workflow configuration")
+    parser.add_argument('--snakefile', default='snakefile')
+    parser.add_argument('--once', action='store_true',
+                        help="process the samples already present, then exit (1 if any failed)")
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    watcher = Watcher(config, args.config, args.snakefile)
+    try:
+        sys.exit(watcher.run(args.once))
+    except KeyboardInterrupt:
+        log(f"Stopping, waiting for {len(watcher.running)} running samples")
+        for process, log_file, _ in watcher.running.values():
+            process.wait()
+            log_file.close()
+    finally:
+        watcher.stop_converters()
@@ -0,0 +1,130 @@
+'''
+DIA/DDA classification of a sample and the small per-sample sidecar file that stores it.
+
+The sidecar ({sample}.acqmode.tsv) is written once by DIA-or-DDA.py and read by the
+snakefile rules and Compare.py instead of classifying the scan table again:
+
+    mode	DIA
+    isolation_windows	40
+    demultiplexing	Yes
+    start_time	2024-06-01T10:00:00Z
+
+classify_file streams the isolation window targets from an mzML (plain or gzip) or a
+per-scan table and stops as soon as the answer is settled, usually after a few
+thousand MS2 scans, so the search engine branch can be chosen right after conversion.
+'''
+import math
+from mzml_stream import iter_isolation_targets, open_mzml, read_header
+from scan_table import iter_scan_table
+
+SIDECAR_SUFFIX = '.acqmode.tsv'
+
+# It is DIA if the isolation window pattern repeated at least this many times
+DIA_REPEATS = 50
+# Streaming: never decide before this many MS2 scans
+MIN_MS2_SCANS = 2000
+# Streaming: DIA is settled once the full window cycle repeated this often without a new target
+STABLE_CYCLES = 5
+
+
+def classify_targets(column):
+    """Classify from the 'Isolation Window Target' values (NaN for MS1 scans).
+
+    Returns (mode, number of distinct targets); mode is None when there are no targets.
+    """
+    targets = column.dropna()
+    if targets.empty:
+        return None, 0
+    # Calculate the number of unique numeric values
+    unique_numeric_values = targets.unique()
+    if len(unique_numeric_values) < len(targets) / DIA_REPEATS:
+        return "DIA", len(unique_numeric_values)
+    return "DDA", len(unique_numeric_values)
+
+
+def classify_stream(targets, min_scans=MIN_MS2_SCANS, early_exit=True):
+    """Classify from a stream of isolation window targets (None/NaN for MS1 scans).
+
+    Stops early once the answer is settled:
+    - DIA when the targets already repeat DIA_REPEATS times and no new target
+      showed up for STABLE_CYCLES full cycles,
+    - DDA when more than half of the targets seen so far are distinct.
+    Otherwise the whole stream is read and the full-file rule of classify_targets applies.
+    Returns (mode, distinct targets, MS2 scans read, stopped early).
+    """
+    seen = set()
+    scans = 0
+    last_new = 0
+    for target in targets:
+        if target is None or math.isnan(target):
+            continue
+        scans += 1
+        if target not in seen:
+            seen.add(target)
+            last_new = scans
+        if early_exit and scans >= min_scans and scans % 100 == 0:
+            if len(seen) < scans / DIA_REPEATS and scans - last_new >= STABLE_CYCLES * len(seen):
+                return "DIA", len(seen), scans, True
+            if len(seen) > scans / 2:
+                return "DDA", len(seen), scans, True
+    if scans == 0:
+        return None, 0, 0, False
+    return ("DIA" if len(seen) < scans / DIA_REPEATS else "DDA"), len(seen), scans, False
+
+
+def is_mzml(file_path):
+    return file_path.endswith(('.mzML', '.mzML.gz', '.mzml', '.mzml.gz'))
+
+
+def classify_file(file_path, early_exit=True):
+    """Stream-classify an mzML or per-scan table.
+
+    Returns the sidecar values plus 'scans_read' and 'stopped_early'. The run start
+    time is only known for mzML input.
+    """
+    start_time = None
+    if is_mzml(file_path):
+        with open_mzml(file_path) as (source, _):
+            demultiplexing, start_time = read_header(source)  # Only reads the header
+            demultiplexing = demultiplexing == "Yes"
+        with open_mzml(file_path) as (source, _):
+            mode, windows, scans, stopped = classify_stream(iter_isolation_targets(source), early_exit=early_exit)
+    else:
+        flags = []
+        def table_targets():
+            for chunk in iter_scan_table(file_path, ['Isolation Window Target', 'Demultiplexing']):
+                flags.append(bool(chunk['Demultiplexing'].any()))
+                yield from chunk['Isolation Window Target'].to_numpy()
+        mode, windows, scans, stopped = classify_stream(table_targets(), early_exit=early_exit)
+        demultiplexing = any(flags)
+    return {
+        'mode': mode,
+        'isolation_windows': windows,
+        'demultiplexing': demultiplexing,
+        'start_time': start_time,
+        'scans_read': scans,
+        'stopped_early': stopped,
+    }
+
+
+def write_sidecar(file_path, result):
+    # A sample without isolation windows follows the DDA branch, as before
+    with open(file_path, 'w') as file:
+        file.write(f"mode\t{result['mode'] or 'DDA'}\n")
+        file.write(f"isolation_windows\t{result['isolation_windows']}\n")
+        file.write(f"demultiplexing\t{'Yes' if result['demultiplexing'] else 'No'}\n")
+        file.write(f"start_time\t{result.get('start_time') or ''}\n")
+
+
+def read_sidecar(file_path):
+    values = {}
+    with open(file_path) as file:
+        for line in file:
+            key, _, value = line.rstrip('\n').partition('\t')
+            values[key] = value
+    return {
+        'mode': values['mode'],
+        'isolation_windows': int(values['isolation_windows']),
+        'demultiplexing': values['demultiplexing'] == 'Yes',
+        'start_time': values.get('start_time') or None,  # Missing in sidecars written before it was added
+    }
@@ -0,0 +1,102 @@
+'''
+Compare the streaming mzid reader and the PSM cache with the former whole-tree ElementTree parse.
+
+python3 benchmarks/bench_mzid.py path/to/sample.mzid [--repeat 3]
+
+Each reader runs in its own process. The wall time and peak RSS come from
+os.wait4, and the readers are checked to keep the same PSMs.
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+def read_tree(file_path, q_value_threshold=0.01):
+    """The reader the report scripts used before: ET.parse plus findall per result."""
+    root = ET.parse(file_path).getroot()
+    namespaces = {'ns': 'http://psidev.info/psi/pi/mzIdentML/1.1'}
+    retention_times, charges, mz_values = [], [], []
+    for spectrum_result in root.findall('.//ns:SpectrumIdentificationResult', namespaces):
+        retention_time = None
+        for cv_param in spectrum_result.findall('.//ns:cvParam', namespaces):
+            if cv_param.get('name') == 'scan start time':
+                retention_time = float(cv_param.get('value'))
+                break
+        if retention_time is None:
+            continue
+        for spectrum_item in spectrum_result.findall('.//ns:SpectrumIdentificationItem', namespaces):
+            q_value = None
+            for cv_param in spectrum_item.findall('.//ns:cvParam', namespaces):
+                if cv_param.get('accession') == 'MS:1002054':
+                    q_value = float(cv_param.get('value'))
+                    break
+            if q_value is not None and q_value < q_value_threshold:
+                charges.append(int(spectrum_item.get('chargeState')))
+                mz_values.append(float(spectrum_item.get('experimentalMassToCharge')))
+                retention_times.append(retention_time)
+    return retention_times, charges, mz_values
+
+
+def read_stream(file_path):
+    from mzid_stream import read_identifications
+    return read_identifications(file_path)
+
+
+def read_cache(file_path):
+    from psm_cache import read_identifications
+    return read_identifications(file_path)
+
+
+# 'cache' builds the PSM cache on its first run and reads it afterwards
+READERS = {'tree': read_tree, 'stream': read_stream, 'cache': read_cache}
+
+
+def run_reader(reader, mzid_file):
+    """Run one read in a child process and return (wall seconds, peak RSS in MB, PSM digest)."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, __file__, '--child', reader, mzid_file],
+                               stdout=subprocess.PIPE, text=True)
+    digest = process.stdout.read().strip()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        sys.exit(f"{reader} reader failed on {mzid_file}")
+    return elapsed, usage.ru_maxrss / 1024, digest  # ru_maxrss is in KB on Linux
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mzid_file')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--readers', nargs='+', default=list(READERS))
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        retention_times, charges, mz_values = READERS[args.child](args.mzid_file)
+        print(len(retention_times), round(sum(retention_times), 6), int(sum(charges)), round(sum(mz_values), 6))
+        return
+
+    size_mb = os.path.getsize(args.mzid_file) / 1e6
+    print(f"{args.mzid_file}: {size_mb:.1f} MB")
+    digests = {}
+    for reader in args.readers:
+        runs = [run_reader(reader, args.mzid_file) for _ in range(args.repeat)]
+        best = min(elapsed for elapsed, _, _ in runs)
+        peak = max(rss for _, rss, _ in runs)
+        digests[reader] = runs[0][2]
+        print(f"{reader:>8}: best {best:.2f} s ({size_mb / best:.1f} MB/s), peak RSS {peak:.0f} MB, "
+              f"{digests[reader].split()[0]} PSMs")
+
+    if len(set(digests.values())) > 1:
+        print(f"WARNING: readers disagree: {digests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+'''
+Compare the mzML-Parser.py engines on a real mzML file.
+
+python3 benchmarks/bench_mzml_parser.py path/to/sample.mzML [--repeat 3] [--engines metadata pyteomics]
+
+Each engine runs in its own process. The wall time and peak RSS come from
+os.wait4, and the CSV outputs are checked to be identical.
+'''
+import argparse
+import filecmp
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSER = os.path.join(REPO_DIR, 'mzML-Parser.py')
+
+
+def run_engine(engine, mzml_file, output_csv):
+    """Run one parse and return (wall seconds, peak RSS in MB)."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, PARSER, '--engine', engine, mzml_file, output_csv],
+                               stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        sys.exit(f"{engine} engine failed on {mzml_file}")
+    return elapsed, usage.ru_maxrss / 1024  # ru_maxrss is in KB on Linux
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mzml_file')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engines', nargs='+', default=['metadata', 'pyteomics'])
+    args = parser.parse_args()
+
+    size_mb = os.path.getsize(args.mzml_file) / 1e6
+    print(f"{args.mzml_file}: {size_mb:.1f} MB")
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = {}
+        for engine in args.engines:
+            outputs[engine] = os.path.join(tmp, engine + '.csv')
+            runs = [run_engine(engine, args.mzml_file, outputs[engine]) for _ in range(args.repeat)]
+            best = min(elapsed for elapsed, _ in runs)
+            peak = max(rss for _, rss in runs)
+            print(f"{engine:>10}: best {best:.2f} s ({size_mb / best:.1f} MB/s), peak RSS {peak:.0f} MB")
+
+        reference = outputs[args.engines[0]]
+        for engine, output in outputs.items():
+            if not filecmp.cmp(reference, output, shallow=False):
+                print(f"WARNING: {engine} output differs from {args.engines[0]}")
+
+
+if __name__ == "__main__":
+    main()
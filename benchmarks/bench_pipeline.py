@@ -0,0 +1,186 @@
+'''
+Time every Python stage of the pipeline on synthetic data and write the results to JSON.
+
+python3 benchmarks/bench_pipeline.py [--rows 100000 ...] [--data DIR] [--repeat 3] [--workers 4]
+    [--stages parse_dda report_dia ...] [--output results.json] [--baseline old.json]
+
+The inputs come from synthetic_data.py (generated once per rows, seed and demultiplexing
+setting, and reused from --data). Each stage runs in its own process, in workflow order,
+and its wall time and peak RSS come from os.wait4. Before every repeat the outputs and
+caches of the previous one are removed, so each repeat is a cold run. With several --rows
+values the suite runs at each scale.
+
+The JSON records the commit, host and settings next to the timings, so two results can
+be compared: --baseline prints the ratio of every stage to an earlier result file.
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+GENERATOR = os.path.join(BENCH_DIR, 'synthetic_data.py')
+MANIFEST = 'synthetic.json'  # Written by synthetic_data.py
+
+
+def generate(data_dir, rows, seed, demultiplexed, peaks):
+    """Synthetic inputs from synthetic_data.py, run in a child so this process stays small: ru_maxrss
+    of the stages would otherwise start from the size of this process with NumPy and pandas loaded."""
+    command = [sys.executable, GENERATOR, data_dir, '--rows', str(rows), '--seed', str(seed), '--peaks', str(peaks)]
+    subprocess.run(command + (['--demultiplexed'] if demultiplexed else []), check=True, stdout=subprocess.DEVNULL)
+    with open(os.path.join(data_dir, MANIFEST)) as file:
+        return json.load(file)['files']
+
+
+def sample_of(path):
+    return os.path.basename(path).split('.')[0]
+
+
+def stage_commands(files, out_dir, workers):
+    """{stage: (command, input files)} in workflow order, with outputs under out_dir."""
+    samples = {mode: sample_of(files[f'{mode}_mzml']) for mode in ['dda', 'dia']}
+    scan_tables = {mode: os.path.join(out_dir, sample + '.features.parquet') for mode, sample in samples.items()}
+    sidecars = {mode: os.path.join(out_dir, sample + '.acqmode.tsv') for mode, sample in samples.items()}
+    script = lambda name: [sys.executable, os.path.join(REPO_DIR, name)]
+    stages = {}
+    for mode in ['dda', 'dia']:
+        stages[f'parse_{mode}'] = (script('mzML-Parser.py') + ['--workers', str(workers), files[f'{mode}_mzml'],
+                                                               scan_tables[mode]], [files[f'{mode}_mzml']])
+    for mode in ['dda', 'dia']:
+        stages[f'classify_{mode}'] = (script('DIA-or-DDA.py') + ['--sidecar', sidecars[mode], files[f'{mode}_mzml']],
+                                      [files[f'{mode}_mzml']])
+    stages['mzid'] = (script('MZid-Parser.py') + [files['dda_mzid']], [files['dda_mzid']])
+    stages['report_dda'] = (script('DDA-Report.py') + [
+        '--plot-workers', str(workers), scan_tables['dda'], files['dda_features'], files['dda_mzid'],
+        os.path.join(out_dir, samples['dda'] + '.pdf'), os.path.join(out_dir, samples['dda'] + '.csv')],
+        [scan_tables['dda'], files['dda_features'], files['dda_mzid']])
+    stages['report_dia'] = (script('DIA-Report.py') + [
+        '--plot-workers', str(workers), scan_tables['dia'], files['dia_stats'], files['dia_features'],
+        files['dia_library'], files['dia_report'], os.path.join(out_dir, samples['dia'] + '.pdf'),
+        os.path.join(out_dir, samples['dia'] + '.csv')],
+        [scan_tables['dia'], files['dia_stats'], files['dia_features'], files['dia_library'], files['dia_report']])
+    compare_inputs = list(scan_tables.values()) + list(sidecars.values()) + [files['dia_stats'], files['dda_mzid_summary']]
+    stages['compare'] = (script('Compare.py') + ['--workers', str(workers)] + compare_inputs
+                         + [os.path.join(out_dir, 'Comparison.pdf')], compare_inputs)
+    return stages
+
+
+def remove_outputs(data_dir, files, out_dir):
+    """Remove what earlier stages wrote: the output folder and the caches next to the inputs."""
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    keep = set(files.values()) | {os.path.join(data_dir, MANIFEST)}
+    for path in glob.glob(os.path.join(data_dir, '*')):
+        if path not in keep and os.path.isfile(path):
+            os.remove(path)
+
+
+def run_stage(name, command, log_file):
+    """Run one stage in a child process and return (wall seconds, peak RSS in MB)."""
+    env = dict(os.environ, MPLBACKEND='Agg')  # MZid-Parser.py shows its plots
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        sys.exit(f"{name} failed, see {log_file.name}")
+    return elapsed, usage.ru_maxrss / 1024  # ru_maxrss is in KB on Linux, the largest of all children
+
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True)
+    dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=REPO_DIR).returncode != 0
+    return result.stdout.strip() + ('-dirty' if dirty else '') if result.returncode == 0 else None
+
+
+def run_scale(rows, args, data_root):
+    data_dir = os.path.join(data_root, f"rows{rows}_seed{args.seed}{'_demux' if args.demultiplexed else ''}")
+    start = time.perf_counter()
+    files = generate(data_dir, rows, args.seed, args.demultiplexed, args.peaks)
+    print(f"{rows} rows: data ready in {time.perf_counter() - start:.1f} s ({data_dir})")
+    out_dir = os.path.join(data_dir, 'outputs')
+    stages = stage_commands(files, out_dir, args.workers)
+    unknown = set(args.stages or []) - set(stages)
+    if unknown:
+        sys.exit(f"Unknown stages {sorted(unknown)}, choose from {list(stages)}")
+    selected = [name for name in stages if not args.stages or name in args.stages]
+    results = {name: {'seconds': [], 'peak_rss_mb': []} for name in selected}
+    for _ in range(args.repeat):
+        remove_outputs(data_dir, files, out_dir)
+        with open(os.path.join(data_dir, 'bench.log'), 'w') as log_file:
+            # The stages before a selected one still run, untimed, to produce its inputs
+            for name, (command, _) in stages.items():
+                elapsed, rss = run_stage(name, command, log_file)
+                if name in results:
+                    results[name]['seconds'].append(round(elapsed, 3))
+                    results[name]['peak_rss_mb'].append(round(rss, 1))
+                if name == selected[-1]:
+                    break
+    for name, result in results.items():
+        result['best_s'] = min(result['seconds'])
+        result['max_rss_mb'] = max(result['peak_rss_mb'])
+        result['input_mb'] = round(sum(os.path.getsize(path) for path in stages[name][1]) / 1e6, 1)
+        print(f"{name:>14}: best {result['best_s']:.2f} s, peak RSS {result['max_rss_mb']:.0f} MB, "
+              f"input {result['input_mb']:.1f} MB")
+    return results
+
+
+def print_comparison(results, baseline_file):
+    with open(baseline_file) as file:
+        baseline = json.load(file)
+    print(f"Against {baseline_file} (commit {baseline['commit']}), time and peak RSS ratios:")
+    for rows, stages in results.items():
+        for name, result in stages.items():
+            before = baseline['results'].get(rows, {}).get(name)
+            if before:
+                print(f"{rows:>9} rows {name:>14}: time x{result['best_s'] / before['best_s']:.2f}, "
+                      f"RSS x{result['max_rss_mb'] / before['max_rss_mb']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000], help="scales to run, e.g. 10000 100000 1000000")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--demultiplexed', action='store_true', help="DIA sample with demultiplexed windows")
+    parser.add_argument('--peaks', type=int, default=10, help="peaks per synthetic spectrum")
+    parser.add_argument('--data', help="folder for the synthetic data, reused between runs (default: temporary)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=4, help="--workers/--plot-workers of the stages")
+    parser.add_argument('--stages', nargs='+', help="stages to time (default: all)")
+    parser.add_argument('--output', help="result JSON (default: bench_pipeline_<commit>.json)")
+    parser.add_argument('--baseline', help="earlier result JSON to compare with")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_root = args.data or tmp
+        results = {str(rows): run_scale(rows, args, data_root) for rows in args.rows}
+
+    record = {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'settings': {'seed': args.seed, 'demultiplexed': args.demultiplexed, 'peaks': args.peaks,
+                     'repeat': args.repeat, 'workers': args.workers},
+        'results': results,
+    }
+    output = args.output or f"bench_pipeline_{commit or 'nogit'}.json"
+    with open(output, 'w') as file:
+        json.dump(record, file, indent=2)
+    print(f"Results written to {output}")
+    if args.baseline:
+        print_comparison(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
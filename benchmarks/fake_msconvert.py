@@ -0,0 +1,63 @@
+'''
+Local stand-in for msconvert, for testing Convert-Raw.py without Docker or Wine.
+
+python3 benchmarks/fake_msconvert.py -o out_dir [-v] [--gzip] [--filter "..."] a.raw [b.raw ...]
+
+Writes out_dir/<name>.mzML (.mzML.gz with --gzip) for each input. A .raw file that is
+actually an mzML (e.g. a renamed test file) is copied, anything else gives a minimal
+mzML. Like msconvert, it goes on with the other files when one fails and exits 1.
+Environment:
+  FAKE_MSCONVERT_STARTUP_S          seconds of start-up per call (Wine), default 0
+  FAKE_MSCONVERT_SECONDS_PER_FILE   conversion time per file, default 0
+  FAKE_MSCONVERT_FAIL_DEMULTIPLEX   regex of file names for which --filter demultiplex fails, default "DDA"
+'''
+import argparse
+import gzip
+import os
+import re
+import sys
+import time
+
+MINIMAL_MZML = b'''<?xml version="1.0" encoding="utf-8"?>
+<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0">
+  <run id="fake" startTimeStamp="2024-06-01T10:00:00Z">
+    <spectrumList count="0"/>
+  </run>
+</mzML>
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', dest='out_dir', default='.')
+    parser.add_argument('-v', action='store_true')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--numpressAll', action='store_true')
+    parser.add_argument('--filter', action='append', default=[])
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    time.sleep(float(os.environ.get('FAKE_MSCONVERT_STARTUP_S', 0)))
+    fail_demultiplex = re.compile(os.environ.get('FAKE_MSCONVERT_FAIL_DEMULTIPLEX', 'DDA'))
+    failed = 0
+    for raw_file in args.files:
+        name = os.path.splitext(os.path.basename(raw_file))[0]
+        time.sleep(float(os.environ.get('FAKE_MSCONVERT_SECONDS_PER_FILE', 0)))
+        if 'demultiplex' in args.filter and fail_demultiplex.search(name):
+            print(f"Error processing {raw_file}: demultiplex failed", file=sys.stderr)
+            failed += 1
+            continue
+        with open(raw_file, 'rb') as file:
+            content = file.read()
+        if not content.startswith(b'<?xml'):
+            content = MINIMAL_MZML
+        output = os.path.join(args.out_dir, name + '.mzML' + ('.gz' if args.gzip else ''))
+        with (gzip.open if args.gzip else open)(output, 'wb') as file:
+            file.write(content)
+        if args.v:
+            print(f"writing output file: {output}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
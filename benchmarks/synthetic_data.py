@@ -0,0 +1,271 @@
+'''
+Deterministic synthetic inputs for the pipeline benchmarks, no instrument data needed.
+
+python3 benchmarks/synthetic_data.py OUT_DIR [--rows 100000] [--seed 1] [--demultiplexed] [--peaks 10]
+
+Writes one DDA and one DIA sample with the files the Python stages read:
+    Synth_10ng_DDA_1.mzML, .features.tsv (Dinosaur), .mzid (MS-GF+), .mzidsummary.txt (QC jar)
+    Synth_50ng_DIA_1.mzML, .features.tsv, .tsv, _result.tsv, .stats.tsv (DIA-NN)
+--rows sets the size of every file: spectra per mzML, features, mzid spectrum results,
+DIA-NN report rows and library rows (10k to 10M). The same rows and seed give the same
+bytes. The peak arrays are drawn from a small pool of encoded arrays, so writing a large
+mzML is not bound by compression. synthetic.json lists the files with their settings.
+'''
+import argparse
+import base64
+import json
+import os
+import zlib
+import numpy as np
+import pandas as pd
+
+DDA_SAMPLE = 'Synth_10ng_DDA_1'
+DIA_SAMPLE = 'Synth_50ng_DIA_1'
+MANIFEST = 'synthetic.json'
+DDA_PRECURSORS_PER_CYCLE = 10
+DIA_WINDOWS = 20
+ARRAY_POOL = 32
+CHUNK_ROWS = 500_000
+
+MZML_HEADER = '''<?xml version="1.0" encoding="utf-8"?>
+<indexedmzML xmlns="http://psi.hupo.org/ms/mzml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0" id="{sample}">
+    <cvList count="2"><cv id="MS" fullName="PSI-MS" version="4.1" URI="https://purl.obolibrary.org/obo/ms.obo"/><cv id="UO" fullName="Unit Ontology" URI="https://purl.obolibrary.org/obo/uo.obo"/></cvList>
+    <fileDescription><fileContent><cvParam cvRef="MS" accession="MS:1000579" name="MS1 spectrum" value=""/></fileContent></fileDescription>
+    <softwareList count="1"><software id="pwiz" version="3.0"><cvParam cvRef="MS" accession="MS:1000615" name="ProteoWizard software" value=""/></software></softwareList>
+    <instrumentConfigurationList count="1"><instrumentConfiguration id="IC1"/></instrumentConfigurationList>
+    <dataProcessingList count="1"><dataProcessing id="pwiz_proc"><processingMethod order="0" softwareRef="pwiz"><cvParam cvRef="MS" accession="MS:1000544" name="Conversion to mzML" value=""/>{demultiplexing}</processingMethod></dataProcessing></dataProcessingList>
+    <run id="{sample}" defaultInstrumentConfigurationRef="IC1" startTimeStamp="2024-06-01T10:00:00Z">
+      <spectrumList count="{count}" defaultDataProcessingRef="pwiz_proc">
+'''
+DEMULTIPLEXING = '<userParam name="PRISM Demultiplexing" value="" type=""/>'
+SPECTRUM = '''      <spectrum index="{index}" id="controllerType=0 controllerNumber=1 scan={scan}" defaultArrayLength="{peaks}">
+        <cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="{level}"/>
+        <cvParam cvRef="MS" accession="MS:1000285" name="total ion current" value="{tic:.2f}"/>
+        <scanList count="1"><cvParam cvRef="MS" accession="MS:1000795" name="no combination" value=""/>
+          <scan instrumentConfigurationRef="IC1"><cvParam cvRef="MS" accession="MS:1000016" name="scan start time" value="{rt:.6f}" unitCvRef="UO" unitAccession="UO:0000031" unitName="minute"/><cvParam cvRef="MS" accession="MS:1000927" name="ion injection time" value="{injection:.3f}" unitCvRef="UO" unitAccession="UO:0000028" unitName="millisecond"/></scan>
+        </scanList>
+{precursor}        <binaryDataArrayList count="2">
+{arrays}        </binaryDataArrayList>
+      </spectrum>
+'''
+PRECURSOR = '''        <precursorList count="1"><precursor spectrumRef="controllerType=0 controllerNumber=1 scan={ms1_scan}"><isolationWindow><cvParam cvRef="MS" accession="MS:1000827" name="isolation window target m/z" value="{target:.4f}" unitCvRef="MS" unitAccession="MS:1000040" unitName="m/z"/><cvParam cvRef="MS" accession="MS:1000828" name="isolation window lower offset" value="{offset}" unitCvRef="MS" unitAccession="MS:1000040" unitName="m/z"/><cvParam cvRef="MS" accession="MS:1000829" name="isolation window upper offset" value="{offset}" unitCvRef="MS" unitAccession="MS:1000040" unitName="m/z"/></isolationWindow><selectedIonList count="1"><selectedIon><cvParam cvRef="MS" accession="MS:1000744" name="selected ion m/z" value="{target:.4f}" unitCvRef="MS" unitAccession="MS:1000040" unitName="m/z"/></selectedIon></selectedIonList><activation><cvParam cvRef="MS" accession="MS:1000133" name="collision-induced dissociation" value=""/></activation></precursor></precursorList>
+'''
+BINARY_ARRAY = '''          <binaryDataArray encodedLength="{length}"><cvParam cvRef="MS" accession="MS:1000523" name="64-bit float" value=""/><cvParam cvRef="MS" accession="MS:1000574" name="zlib compression" value=""/><cvParam cvRef="MS" accession="{accession}" name="{name}" value=""/><binary>{data}</binary></binaryDataArray>
+'''
+
+
+def encoded_arrays(rng, peaks):
+    """Pool of (m/z, intensity) binaryDataArray pairs, zlib-compressed 64-bit floats."""
+    pool = []
+    for _ in range(ARRAY_POOL):
+        mz = np.sort(rng.uniform(300, 1500, peaks))
+        intensity = rng.uniform(1e3, 1e6, peaks)
+        text = ''
+        for values, accession, name in [(mz, 'MS:1000514', 'm/z array'), (intensity, 'MS:1000515', 'intensity array')]:
+            data = base64.b64encode(zlib.compress(values.astype('<f8').tobytes())).decode()
+            text += BINARY_ARRAY.format(length=len(data), accession=accession, name=name, data=data)
+        pool.append((text, float(intensity.sum())))
+    return pool
+
+
+def write_mzml(path, spectra, dia, demultiplexed=False, peaks=10, seed=1):
+    """Indexed mzML with MS1 scans followed by DIA windows or DDA precursors, as msconvert writes it."""
+    rng = np.random.default_rng(seed)
+    pool = encoded_arrays(rng, peaks)
+    per_cycle = 1 + (DIA_WINDOWS if dia else DDA_PRECURSORS_PER_CYCLE)
+    sample = os.path.basename(path).split('.')[0]
+    offsets = []
+    with open(path, 'w') as file:
+        position = file.write(MZML_HEADER.format(sample=sample, count=spectra,
+                                                 demultiplexing=DEMULTIPLEXING if demultiplexed else ''))
+        for start in range(0, spectra, CHUNK_ROWS):
+            indices = np.arange(start, min(start + CHUNK_ROWS, spectra))
+            picks = rng.integers(0, ARRAY_POOL, len(indices))
+            injection = rng.uniform(5, 50, len(indices))
+            dda_targets = rng.uniform(350, 1400, len(indices))
+            parts = []
+            for index, pick, injection_time, dda_target in zip(indices.tolist(), picks.tolist(),
+                                                               injection.tolist(), dda_targets.tolist()):
+                cycle, position_in_cycle = divmod(index, per_cycle)
+                precursor = ''
+                if position_in_cycle:
+                    if dia:
+                        # Demultiplexed runs alternate the window placement by half a window per cycle
+                        target = 400.0 + 25.0 * (position_in_cycle - 1) + (12.5 if demultiplexed and cycle % 2 else 0.0)
+                        offset = 12.5
+                    else:
+                        target, offset = dda_target, 0.8
+                    precursor = PRECURSOR.format(ms1_scan=cycle * per_cycle + 1, target=target, offset=offset)
+                arrays, tic = pool[pick]
+                text = SPECTRUM.format(index=index, scan=index + 1, peaks=peaks, level=2 if position_in_cycle else 1,
+                                       tic=tic, rt=index * 0.001, injection=injection_time,
+                                       precursor=precursor, arrays=arrays)
+                offsets.append(position + 6)  # The <spectrum tag after the indent
+                position += len(text)
+                parts.append(text)
+            file.write(''.join(parts))
+        position += file.write('      </spectrumList>\n    </run>\n  </mzML>\n')
+        index_offset = position + 2
+        file.write('  <indexList count="2">\n    <index name="spectrum">\n')
+        file.write(''.join(f'      <offset idRef="controllerType=0 controllerNumber=1 scan={index + 1}">{offset}</offset>\n'
+                           for index, offset in enumerate(offsets)))
+        file.write('    </index>\n    <index name="chromatogram">\n    </index>\n  </indexList>\n')
+        file.write(f'  <indexListOffset>{index_offset}</indexListOffset>\n  <fileChecksum>0</fileChecksum>\n</indexedmzML>\n')
+
+
+def write_table(path, make_chunk, rows, rng):
+    """Write a TSV from DataFrames of at most CHUNK_ROWS rows."""
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk = make_chunk(rng, min(CHUNK_ROWS, rows - start), start)
+        chunk.to_csv(path, sep='\t', index=False, header=start == 0, mode='w' if start == 0 else 'a', float_format='%.6g')
+
+
+def features_chunk(rng, n, start):
+    mz = rng.uniform(300, 1500, n)
+    charge = rng.choice([1, 2, 2, 3, 4], n)
+    rt = rng.uniform(0, 60, n)
+    return pd.DataFrame({
+        'mz': mz, 'mostAbundantMz': mz, 'charge': charge, 'rtStart': rt - 0.1, 'rtApex': rt, 'rtEnd': rt + 0.1,
+        'fwhm': 0.05, 'nIsotopes': 3, 'nScans': 10, 'averagineCorr': 0.9, 'mass': mz * charge, 'massCalib': mz * charge,
+        'intensityApex': rng.uniform(1e4, 1e7, n), 'intensitySum': rng.uniform(1e5, 1e8, n)})
+
+
+def write_features(path, rows, seed=2):
+    """Dinosaur features.tsv with its full column set."""
+    write_table(path, features_chunk, rows, np.random.default_rng(seed))
+
+
+def write_mzid(path, rows, seed=3):
+    """MS-GF+ mzIdentML with rows spectrum results of two ranked PSMs each; returns the PSMs at q < 0.01."""
+    rng = np.random.default_rng(seed)
+    peptides = max(1, rows // 3)
+    identified = 0
+    with open(path, 'w') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n<MzIdentML id="" version="1.1.0" '
+                   'xmlns="http://psidev.info/psi/pi/mzIdentML/1.1">\n<SequenceCollection>\n'
+                   '<DBSequence id="DBSeq1" length="10" searchDatabase_ref="SearchDB_1" accession="P1"/>\n')
+        for start in range(0, peptides, CHUNK_ROWS):
+            file.write(''.join(f'<Peptide id="Pep_{i}"><PeptideSequence>PEPTIDE{i}K</PeptideSequence></Peptide>\n'
+                               for i in range(start, min(start + CHUNK_ROWS, peptides))))
+        for start in range(0, peptides, CHUNK_ROWS):
+            file.write(''.join(f'<PeptideEvidence id="PepEv_{i}" dBSequence_ref="DBSeq1" peptide_ref="Pep_{i}" '
+                               f'start="1" end="8" pre="K" post="A" isDecoy="false"/>\n'
+                               for i in range(start, min(start + CHUNK_ROWS, peptides))))
+        file.write('</SequenceCollection>\n<DataCollection>\n<AnalysisData>\n<SpectrumIdentificationList id="SI_LIST_1">\n')
+        for start in range(0, rows, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, rows - start)
+            retention_times = rng.uniform(0, 3600, n)
+            peptide = rng.integers(0, peptides, (n, 2))
+            charge = rng.choice([1, 2, 2, 3], (n, 2))
+            mz = rng.uniform(300, 1500, (n, 2))
+            raw_score = rng.integers(0, 200, (n, 2))
+            spec_e_value = rng.uniform(1e-15, 1e-5, (n, 2))
+            q_value = rng.choice([0.0, 0.001, 0.005, 0.02, 0.3], (n, 2))
+            identified += int((q_value < 0.01).sum())
+            parts = []
+            for row in range(n):
+                i = start + row
+                parts.append(f'<SpectrumIdentificationResult spectrumID="index={i}" spectraData_ref="SID_1" id="SIR_{i}">\n')
+                for rank in (1, 2):
+                    k = rank - 1
+                    pep = peptide[row, k]
+                    parts.append(
+                        f'<SpectrumIdentificationItem chargeState="{charge[row, k]}" experimentalMassToCharge="{mz[row, k]:.5f}" '
+                        f'calculatedMassToCharge="500.0" peptide_ref="Pep_{pep}" rank="{rank}" passThreshold="true" id="SII_{i}_{rank}">\n'
+                        f'<PeptideEvidenceRef peptideEvidence_ref="PepEv_{pep}"/>\n'
+                        f'<cvParam cvRef="PSI-MS" accession="MS:1002049" name="MS-GF:RawScore" value="{raw_score[row, k]}"/>\n'
+                        f'<cvParam cvRef="PSI-MS" accession="MS:1002052" name="MS-GF:SpecEValue" value="{spec_e_value[row, k]:.6g}"/>\n'
+                        f'<cvParam cvRef="PSI-MS" accession="MS:1002054" name="MS-GF:QValue" value="{q_value[row, k]}"/>\n'
+                        f'<userParam name="IsotopeError" value="0"/>\n</SpectrumIdentificationItem>\n')
+                parts.append(f'<cvParam cvRef="PSI-MS" accession="MS:1000016" name="scan start time" value="{retention_times[row]:.4f}" '
+                             f'unitCvRef="UO" unitAccession="UO:0000010" unitName="second"/>\n</SpectrumIdentificationResult>\n')
+            file.write(''.join(parts))
+        file.write('</SpectrumIdentificationList>\n</AnalysisData>\n</DataCollection>\n</MzIdentML>\n')
+    return identified
+
+
+def write_mzid_summary(path, identified):
+    """The two-line summary the QC jar writes for an mzid; Compare.py reads the second line."""
+    with open(path, 'w') as file:
+        file.write(f"PSMs\tPeptides\n{identified}\t{identified // 2}\n")
+
+
+def write_diann(prefix, rows, seed=4):
+    """DIA-NN main report ({prefix}.tsv), spectral library ({prefix}_result.tsv) and {prefix}.stats.tsv."""
+    rng = np.random.default_rng(seed)
+    fragments = 6
+    precursors = max(1, rows // (2 * fragments))  # Two charge states of six fragments per peptide in the library
+    peptides = np.array([f'PEPT(UniMod:35)IDE{i}K' for i in range(precursors)], dtype=object)
+
+    def report_chunk(rng, n, start):
+        peptide = peptides[rng.integers(0, precursors, n)]
+        charge = rng.choice([2, 3], n)
+        rt = rng.uniform(0, 60, n)
+        return pd.DataFrame({
+            'File.Name': 'run.mzML', 'Run': 'run', 'Protein.Group': 'P1', 'Genes': 'G1', 'Modified.Sequence': peptide,
+            'Stripped.Sequence': peptide, 'Precursor.Id': peptide + charge.astype(str), 'Precursor.Charge': charge,
+            'Q.Value': 0.001, 'RT': rt, 'RT.Start': rt - 0.1, 'RT.Stop': rt + 0.1, 'Precursor.Quantity': rng.uniform(1e3, 1e6, n)})
+
+    def library_chunk(rng, n, start):
+        row = np.arange(start, start + n)
+        peptide = peptides[np.minimum(row // (2 * fragments), precursors - 1)]
+        charge = 2 + (row // fragments) % 2
+        transition_group = peptide + charge.astype(str)
+        return pd.DataFrame({
+            'FileName': 'run', 'PrecursorMz': rng.uniform(300, 1500, n), 'ProductMz': rng.uniform(100, 1500, n),
+            'Tr_recalibrated': rng.uniform(0, 60, n), 'transition_name': transition_group + '_y' + (row % fragments).astype(str),
+            'LibraryIntensity': 1.0, 'transition_group_id': transition_group, 'decoy': 0, 'PeptideSequence': peptide,
+            'ProteinName': 'P1', 'Genes': 'G1', 'ModifiedPeptide': peptide, 'PrecursorCharge': charge, 'FragmentType': 'y'})
+
+    write_table(prefix + '.tsv', report_chunk, rows, rng)
+    write_table(prefix + '_result.tsv', library_chunk, rows, rng)
+    with open(prefix + '.stats.tsv', 'w') as file:
+        file.write('File.Name\tPrecursors.Identified\tProteins.Identified\tTotal.Quantity\tMS1.Signal\tMS2.Signal\tFWHM.Scans\tFWHM.RT\n')
+        file.write(f'run.mzML\t{2 * precursors}\t{max(1, precursors // 5)}\t1e9\t1e9\t1e9\t5\t0.1\n')
+
+
+def sample_files(out_dir):
+    """{role: path} of the synthetic files, named like the workflow names them."""
+    dda, dia = os.path.join(out_dir, DDA_SAMPLE), os.path.join(out_dir, DIA_SAMPLE)
+    return {
+        'dda_mzml': dda + '.mzML', 'dda_features': dda + '.features.tsv', 'dda_mzid': dda + '.mzid',
+        'dda_mzid_summary': dda + '.mzidsummary.txt',
+        'dia_mzml': dia + '.mzML', 'dia_features': dia + '.features.tsv', 'dia_report': dia + '.tsv',
+        'dia_library': dia + '_result.tsv', 'dia_stats': dia + '.stats.tsv',
+    }
+
+
+def generate(out_dir, rows, seed=1, demultiplexed=False, peaks=10):
+    """Write the synthetic samples unless out_dir already holds them for the same settings; returns the files."""
+    settings = {'rows': rows, 'seed': seed, 'demultiplexed': demultiplexed, 'peaks': peaks}
+    files = sample_files(out_dir)
+    manifest = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(manifest):
+        with open(manifest) as file:
+            if json.load(file)['settings'] == settings and all(os.path.exists(path) for path in files.values()):
+                return files
+    os.makedirs(out_dir, exist_ok=True)
+    write_mzml(files['dda_mzml'], rows, dia=False, peaks=peaks, seed=seed)
+    write_mzml(files['dia_mzml'], rows, dia=True, demultiplexed=demultiplexed, peaks=peaks, seed=seed + 1)
+    write_features(files['dda_features'], rows, seed + 2)
+    write_features(files['dia_features'], rows, seed + 3)
+    identified = write_mzid(files['dda_mzid'], rows, seed + 4)
+    write_mzid_summary(files['dda_mzid_summary'], identified)
+    write_diann(os.path.join(out_dir, DIA_SAMPLE), rows, seed + 5)
+    with open(manifest, 'w') as file:
+        json.dump({'settings': settings, 'files': files}, file, indent=2)
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=int, default=100_000, help="spectra, features, PSM results and DIA-NN rows per file")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--demultiplexed', action='store_true', help="DIA sample with overlapping, demultiplexed windows")
+    parser.add_argument('--peaks', type=int, default=10, help="peaks per spectrum")
+    args = parser.parse_args()
+
+    for role, path in generate(args.out_dir, args.rows, args.seed, args.demultiplexed, args.peaks).items():
+        print(f"{role:>17}: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
@@ -0,0 +1,57 @@
+'''
+Join of the DIA-NN spectral library ({sample}_result.tsv) with the main report
+({sample}.tsv) for the identified RT vs precursor m/z plots of the DIA report.
+
+Only the needed columns are read, both files in chunks. The library has one row per
+fragment ion, so it is first reduced to its distinct precursors (peptide, m/z, charge)
+and the peptide strings are replaced by integer codes. Each chunk of the main report
+is then mapped to those codes and joined on them, keeping only numeric columns, so
+peak memory depends on the chunk size and the number of precursors, not on the
+size of the report.
+'''
+import numpy as np
+
+LIBRARY_COLUMNS = ['ModifiedPeptide', 'PrecursorMz', 'PrecursorCharge']
+REPORT_COLUMNS = ['Modified.Sequence', 'RT']
+CHUNK_ROWS = 500_000
+
+
+def read_library_precursors(library_file, chunk_rows=CHUNK_ROWS):
+    """Distinct (ModifiedPeptide, PrecursorMz, PrecursorCharge) rows of the library."""
+    import pandas as pd
+
+    chunks = pd.read_csv(library_file, sep='\t', usecols=LIBRARY_COLUMNS, chunksize=chunk_rows,
+                         dtype={'ModifiedPeptide': 'str', 'PrecursorMz': 'float64', 'PrecursorCharge': 'int64'})
+    precursors = pd.concat(chunk.drop_duplicates() for chunk in chunks)
+    return precursors.drop_duplicates(ignore_index=True)
+
+
+def join_library_report(library_file, report_file, chunk_rows=CHUNK_ROWS):
+    """RT from the report with PrecursorMz and PrecursorCharge from the library, matched on the modified peptide.
+
+    Returns (retention_times, precursor_mz, precursor_charge) NumPy arrays, one entry
+    per report row and library precursor of the same peptide.
+    """
+    import pandas as pd
+
+    precursors = read_library_precursors(library_file, chunk_rows)
+    peptides = pd.Index(precursors['ModifiedPeptide'].unique())
+    precursors = pd.DataFrame({
+        'code': peptides.get_indexer(precursors['ModifiedPeptide']),
+        'PrecursorMz': precursors['PrecursorMz'].to_numpy(),
+        'PrecursorCharge': precursors['PrecursorCharge'].to_numpy(),
+    })
+
+    retention_times, precursor_mz, precursor_charge = [], [], []
+    for chunk in pd.read_csv(report_file, sep='\t', usecols=REPORT_COLUMNS, chunksize=chunk_rows,
+                             dtype={'Modified.Sequence': 'str', 'RT': 'float64'}):
+        codes = peptides.get_indexer(chunk['Modified.Sequence'])
+        found = codes >= 0  # -1: peptide not in the library
+        joined = pd.DataFrame({'code': codes[found], 'RT': chunk['RT'].to_numpy()[found]}).merge(precursors, on='code')
+        retention_times.append(joined['RT'].to_numpy())
+        precursor_mz.append(joined['PrecursorMz'].to_numpy())
+        precursor_charge.append(joined['PrecursorCharge'].to_numpy())
+
+    if not retention_times:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    return np.concatenate(retention_times), np.concatenate(precursor_mz), np.concatenate(precursor_charge)
@@ -0,0 +1,83 @@
+'''
+Loader for Dinosaur's {sample}.features.tsv, shared by the report scripts.
+
+Only the columns the reports use are read, with explicit dtypes, so a file with
+millions of features loads straight into NumPy arrays. With cache=True the typed
+columns are also kept in a {sample}.features.tsv.parquet sidecar, which is reused
+as long as the size and mtime of the TSV it was made from have not changed.
+'''
+import os
+import tempfile
+
+FEATURE_DTYPES = {
+    'mz': 'float64',
+    'rtApex': 'float64',
+    'charge': 'int64',
+    'intensityApex': 'float64',
+    'intensitySum': 'float64',
+}
+CACHE_SUFFIX = '.parquet'
+
+
+def cache_path(features_file):
+    return features_file + CACHE_SUFFIX
+
+
+def _source_key(features_file):
+    stat = os.stat(features_file)
+    return {b'source_size': str(stat.st_size).encode(), b'source_mtime_ns': str(stat.st_mtime_ns).encode()}
+
+
+def _read_cache(features_file, cache_file):
+    """The cached features, or None when there is no cache for this version of the TSV."""
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    if not os.path.exists(cache_file):
+        return None
+    metadata = pq.read_schema(cache_file).metadata or {}
+    key = _source_key(features_file)
+    if any(metadata.get(name) != value for name, value in key.items()):
+        return None
+    return pd.read_parquet(cache_file)
+
+
+def _write_cache(features, features_file, cache_file):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(features, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, **_source_key(features_file)})
+    # A temporary file of its own, so concurrent writers of the same cache never share a half-written file
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), suffix='.tmp')
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp_file)
+        os.chmod(tmp_file, 0o644)  # mkstemp creates it private to the user
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def read_features(features_file, cache=False):
+    """Dinosaur features as a DataFrame with the FEATURE_DTYPES columns."""
+    import pandas as pd
+
+    if cache:
+        features = _read_cache(features_file, cache_path(features_file))
+        if features is not None:
+            return features
+    features = pd.read_csv(features_file, sep='\t', usecols=list(FEATURE_DTYPES), dtype=FEATURE_DTYPES)
+    if cache:
+        try:
+            _write_cache(features, features_file, cache_path(features_file))
+        except OSError as error:
+            print(f"Could not write the feature cache {cache_path(features_file)}: {error}")
+    return features
+
+
+def load_features(features_file, cache=False):
+    """Return (rt_apex, mz, high_charge) NumPy arrays; high_charge masks the features with charge >= 2."""
+    features = read_features(features_file, cache)
+    return features['rtApex'].to_numpy(), features['mz'].to_numpy(), features['charge'].to_numpy() >= 2
@@ -0,0 +1,185 @@
+'''
+SQLite store of the per-sample comparison metrics (sample_metrics), so the
+comparison report is rendered from one query instead of re-reading every scan
+table, .stats.tsv and .mzidsummary.txt of the project.
+
+Rows belong to a project, the folder of the sample's .raw file (path_to_samples),
+so samples of the same name in different folders are kept apart and one store can
+serve several projects. Each sample is inserted once, when its pipeline has
+finished; inserting it again replaces its rows. --flag writes the stored rows to a
+file as well, a workflow output that changes whenever the sample's rows do. --prune
+deletes the rows of the project's samples whose .raw file is no longer in the folder.
+Rows are indexed by the sample key and nanogram load that the comparison plots group
+by. The database is in WAL mode, so parallel inserts from several Snakemake jobs
+wait for each other instead of failing.
+
+#python3 metrics_store.py metrics.sqlite --project RawFiles/Test/ --scan-table Sample.features.parquet --acqmode Sample.acqmode.tsv --identifications Sample.stats.tsv Sample.mzidsummary.txt [--flag Sample.stored]
+#python3 metrics_store.py metrics.sqlite --project RawFiles/Test/ --prune
+'''
+import argparse
+import json
+import os
+import sqlite3
+import time
+from sample_metrics import identification_metrics, scan_table_metrics
+
+BUSY_TIMEOUT_S = 120
+RAW_SUFFIX = '.raw'
+SCAN_COLUMNS = ['project', 'sample', 'file', 'mode', 'key', 'nanogram', 'isolation_windows', 'ms1_scans', 'ms2_scans',
+                'median_injection_time', 'run_start']
+IDENTIFICATION_COLUMNS = ['project', 'file', 'sample', 'mode', 'key', 'nanogram', 'precursors_identified']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scan_metrics (
+    project TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    file TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    key TEXT NOT NULL,
+    nanogram REAL,
+    isolation_windows INTEGER,
+    ms1_scans INTEGER NOT NULL,
+    ms2_scans INTEGER NOT NULL,
+    median_injection_time REAL,
+    run_start TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (project, sample)
+);
+CREATE TABLE IF NOT EXISTS identification_metrics (
+    project TEXT NOT NULL,
+    file TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    mode TEXT,
+    key TEXT NOT NULL,
+    nanogram REAL,
+    precursors_identified INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (project, file)
+);
+CREATE INDEX IF NOT EXISTS scan_metrics_key ON scan_metrics (key, nanogram);
+CREATE INDEX IF NOT EXISTS identification_metrics_key ON identification_metrics (key, nanogram);
+CREATE INDEX IF NOT EXISTS scan_metrics_run_start ON scan_metrics (run_start);
+'''
+# Columns added after the first release of the store, added to older databases on connect
+ADDED_COLUMNS = {'scan_metrics': [('median_injection_time', 'REAL'), ('run_start', 'TEXT')]}
+# Rows stored before the project column existed, kept under this project until their samples are stored again
+LEGACY_PROJECT = ''
+
+
+def project_id(samples_folder):
+    """Project of the samples in a folder: its absolute, symlink-free path."""
+    return os.path.realpath(samples_folder)
+
+
+def _add_project(conn, table):
+    """Rebuild a table of an older store, keyed without the project, with the project column."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if not columns or 'project' in columns:
+        return
+    conn.execute(f"ALTER TABLE {table} RENAME TO {table}_unscoped")
+    conn.executescript(SCHEMA)
+    conn.execute(f"INSERT INTO {table} (project, {', '.join(columns)}) "
+                 f"SELECT ?, {', '.join(columns)} FROM {table}_unscoped", (LEGACY_PROJECT,))
+    conn.execute(f"DROP TABLE {table}_unscoped")
+
+
+def connect(db_path):
+    """Open (and create if needed) the metrics database."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S)
+    conn.execute('PRAGMA journal_mode=WAL')
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, column_type in columns:
+            if existing and column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    with conn:
+        for table in ['scan_metrics', 'identification_metrics']:
+            _add_project(conn, table)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _insert(conn, table, columns, rows):
+    now = time.time()
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, updated) VALUES ({', '.join('?' * (len(columns) + 1))})",
+        [[row[column] for column in columns] + [now] for row in rows])
+
+
+def insert_sample(conn, project, scan_metrics=None, identified_metrics=()):
+    """Store one sample's scan_table_metrics and identification_metrics results in one transaction."""
+    with conn:
+        if scan_metrics is not None:
+            _insert(conn, 'scan_metrics', SCAN_COLUMNS, [{**scan_metrics, 'project': project}])
+        _insert(conn, 'identification_metrics', IDENTIFICATION_COLUMNS,
+                [{**metrics, 'project': project} for metrics in identified_metrics])
+
+
+def prune_samples(conn, project, samples):
+    """Delete the rows of the project's samples that are not in samples; returns the deleted sample names."""
+    keep = set(samples)
+    stored = {row[0] for table in ['scan_metrics', 'identification_metrics']
+              for row in conn.execute(f"SELECT DISTINCT sample FROM {table} WHERE project = ?", (project,))}
+    removed = sorted(stored - keep)
+    with conn:
+        for table in ['scan_metrics', 'identification_metrics']:
+            conn.executemany(f"DELETE FROM {table} WHERE project = ? AND sample = ?",
+                             [(project, sample) for sample in removed])
+    return removed
+
+
+def _select(conn, table, columns, project=None):
+    where, values = ("WHERE project = ?", (project,)) if project is not None else ("", ())
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY file", values)
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def load_metrics(db_path, project=None):
+    """(scan_metrics, identified_metrics) of the stored samples of a project (default: all), as returned by sample_metrics."""
+    conn = connect(db_path)
+    try:
+        return (_select(conn, 'scan_metrics', SCAN_COLUMNS, project),
+                _select(conn, 'identification_metrics', IDENTIFICATION_COLUMNS, project))
+    finally:
+        conn.close()
+
+
+def raw_samples(samples_folder):
+    """Names of the samples with a .raw file in the folder, as in the snakefile's samples_to_analyse."""
+    return [name[:-len(RAW_SUFFIX)] for name in os.listdir(samples_folder) if name.endswith(RAW_SUFFIX)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert one sample's comparison metrics into the metrics store, "
+                                                 "or prune the samples that left the project")
+    parser.add_argument('db', help="SQLite metrics database, created if missing")
+    parser.add_argument('--project', required=True, help="folder of the project's .raw files (path_to_samples)")
+    parser.add_argument('--scan-table', help="per-scan table (.features.parquet or .features.csv)")
+    parser.add_argument('--acqmode', help="acquisition mode sidecar of the sample (.acqmode.tsv)")
+    parser.add_argument('--identifications', nargs='*', default=[], help=".stats.tsv and/or .mzidsummary.txt files")
+    parser.add_argument('--flag', help="file to write the stored rows to, as JSON")
+    parser.add_argument('--prune', action='store_true',
+                        help="delete the project's samples without a .raw file in the project folder")
+    args = parser.parse_args()
+
+    project = project_id(args.project)
+    conn = connect(args.db)
+    try:
+        if args.prune:
+            removed = prune_samples(conn, project, raw_samples(args.project))
+            if removed:
+                print(f"Removed {len(removed)} samples no longer in {args.project}: {', '.join(removed)}")
+        scan_metrics = scan_table_metrics(args.scan_table, args.acqmode) if args.scan_table else None
+        identified_metrics = [identification_metrics(file_path) for file_path in args.identifications]
+        if scan_metrics is not None or identified_metrics:
+            insert_sample(conn, project, scan_metrics, identified_metrics)
+    finally:
+        conn.close()
+    if args.flag:
+        with open(args.flag, 'w') as file:
+            json.dump({'project': project, 'scan_metrics': scan_metrics, 'identification_metrics': identified_metrics},
+                      file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
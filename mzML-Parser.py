@@ -1,31 +1,44 @@
 '''
-Before running this script, ensure that 'pyteomics' and 'lxml' libraries are installed. 
-These can be installed via pip.
-'''
-import csv
-import sys
-#pip install pyteomics
-#pip install lxml (if import pyteomics then we need to write pyteomics.mzml)
-from pyteomics import mzml
-import xml.etree.ElementTree as ET
+The default engine only needs the Python standard library. For '--engine pyteomics',
+ensure that 'pyteomics' and 'lxml' libraries are installed. These can be installed via pip.
+
+python3 mzML-Parser.py [--engine metadata|pyteomics] [--workers N] input.mzML[.gz] output.parquet|output.csv
 
+The default 'metadata' engine reads the scan-level cvParams straight from the XML
+and skips the binary peak arrays. 'pyteomics' decodes every spectrum and is kept
+as the reference implementation. With --workers N the metadata engine splits the
+spectrum offset index of an indexed mzML into contiguous shards, parses them in a
+process pool and merges the rows back in scan order.
 
-def check_for_prism_demultiplexing(file_path):
-    """Check for 'PRISM Demultiplexing' in the mzML file using XML parsing."""
-    for event, elem in ET.iterparse(file_path, events=('start',)):
-        if elem.tag.endswith('userParam'):  # Check if the element is a userParam tag
-            if elem.attrib.get('name') == 'PRISM Demultiplexing':
-                return "Yes"
-        elem.clear()  # Prevent memory buildup by clearing elements after processing
-    return "No"
+The rows are streamed to a typed Parquet table (see scan_table.py) in chunks, so
+the run is never held in memory. A .csv output keeps the old 'N/A' CSV format.
+
+Gzip-compressed input (.mzML.gz) is decompressed while streaming. MS-Numpress arrays
+are skipped by the metadata engine; the pyteomics engine needs 'pynumpress' to decode them.
+'''
+import argparse
+import os
+import time
+from collections import deque
+from mzml_stream import (check_for_prism_demultiplexing, find_spectrum_list_end, open_mzml,
+                         parse_metadata, parse_shard, read_spectrum_offsets, report_throughput, split_shards)
+from scan_table import write_table
+from worker_pool import process_pool
+import profiling
 
 
 # Function to parse mzML and extract desired features
-def parse_mzml(file_path):
-    results = []
-    demultiplexing = check_for_prism_demultiplexing(file_path)  # Perform the check for the entire file
-    with mzml.read(file_path) as reader:
+def parse_mzml_pyteomics(file_path):
+    #pip install pyteomics
+    #pip install lxml (if import pyteomics then we need to write pyteomics.mzml)
+    from pyteomics import mzml  # Only needed by this engine
+    spectra = 0
+    start = time.perf_counter()
+    with open_mzml(file_path) as (source, _):
+        demultiplexing = check_for_prism_demultiplexing(source)  # Only reads the header before <run>
+    with open_mzml(file_path) as (source, counter), mzml.read(source) as reader:
         for spectrum in reader:
+            spectra += 1
             if 'precursorList' in spectrum and spectrum['precursorList']['count'] > 0:
                 precursor = spectrum['precursorList']['precursor'][0]
                 selected_ion = precursor['selectedIonList']['selectedIon'][0]
@@ -35,8 +48,10 @@ def parse_mzml(file_path):
                 isolation_window_target = precursor['isolationWindow'].get('isolation window target m/z', 'N/A')
                 isolation_window_upper = precursor['isolationWindow'].get('isolation window upper offset', 'N/A')
                 isolation_window_lower = precursor['isolationWindow'].get('isolation window lower offset', 'N/A')
-# Create a dictionary and add it to result
-                results.append({
+# Create a dictionary and pass it on to the writer
+                yield {
+                    'Spectrum Index': spectrum['index'],
+                    'MS1': False,
                     'Precursor Ion m/z': precursor_mz,
                     'Retention Time': retention_time,
                     'Injection Time': injection_time,
@@ -47,14 +62,16 @@ def parse_mzml(file_path):
                     'Base Peak Intensity': 'N/A',
                     'Total Ion Current': 'N/A',
                     'Demultiplexing': demultiplexing
-                })
+                }
             if spectrum['ms level'] == 1:
                 base_peak_mz = spectrum.get('base peak m/z', 'N/A')
                 base_peak_intensity = spectrum.get('base peak intensity', 'N/A')
                 total_ion_current = spectrum.get('total ion current', 'N/A')
                 retention_time = spectrum['scanList']['scan'][0]['scan start time']
-# Create a dictionary and add it to result
-                results.append({
+# Create a dictionary and pass it on to the writer
+                yield {
+                    'Spectrum Index': spectrum['index'],
+                    'MS1': True,
                     'Precursor Ion m/z': 'N/A',  # Not applicable for MS1, set as N/A
                     'Retention Time': retention_time,
                     'Injection Time': 'N/A',  # Optionally, add if applicable
@@ -65,22 +82,72 @@ def parse_mzml(file_path):
                     'Base Peak Intensity': base_peak_intensity,
                     'Total Ion Current': total_ion_current,
                     'Demultiplexing': demultiplexing
-                })
-    return results
+                }
+    report_throughput(spectra, counter.bytes_read, os.path.getsize(file_path), time.perf_counter() - start)
+
+
+# Same rows as parse_mzml_pyteomics, but the peak arrays are never decoded
+def parse_mzml_metadata(file_path, workers=1):
+    if workers > 1:
+        offsets = read_spectrum_offsets(file_path)
+        if offsets:
+            yield from parse_mzml_sharded(file_path, offsets, workers)
+            return
+        print("No usable spectrum offset index (not indexed or gzip-compressed), parsing serially")
+    stats = {}
+    start = time.perf_counter()
+    with open_mzml(file_path) as (source, counter):
+        yield from parse_metadata(source, stats)
+    report_throughput(stats['spectra'], counter.bytes_read, os.path.getsize(file_path), time.perf_counter() - start)
+
+
+# Parse contiguous shards of the spectrum index in parallel, rows come back in scan order
+def parse_mzml_sharded(file_path, offsets, workers):
+    start = time.perf_counter()
+    with open_mzml(file_path) as (source, counter):
+        demultiplexing = check_for_prism_demultiplexing(source)  # Only reads the header before <run>
+    shards = deque(split_shards(offsets, find_spectrum_list_end(file_path, offsets[-1]), workers * 4))
+    spectra = 0
+    bytes_read = counter.bytes_read
+    # Not forked: the pool starts while the writer consumes the rows, with pyarrow's threads running
+    with process_pool(workers, preload=['mzml_stream']) as executor:
+        pending = deque()
+        while shards or pending:
+            # Keep at most two shards per worker in flight so finished rows don't pile up
+            while shards and len(pending) < workers * 2:
+                shard_start, shard_end = shards.popleft()
+                pending.append(executor.submit(parse_shard, file_path, shard_start, shard_end, demultiplexing))
+            rows, shard_spectra, shard_bytes = pending.popleft().result()  # In submission (scan) order
+            yield from rows
+            spectra += shard_spectra
+            bytes_read += shard_bytes
+    report_throughput(spectra, bytes_read, os.path.getsize(file_path), time.perf_counter() - start)
+
 
+ENGINES = {
+    'metadata': parse_mzml_metadata,
+    'pyteomics': parse_mzml_pyteomics,
+}
 
-# Write results to a CSV file
-def write_to_csv(results, output_file):
-    keys = results[0].keys()
-    with open(output_file, 'w', newline='') as file:
-        dict_writer = csv.DictWriter(file, keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(results)
 
 # Main execution
-mzml_file = sys.argv[1]
-output_csv = sys.argv[2]
-# Call the two functions
-parsed_data = parse_mzml(mzml_file)
-write_to_csv(parsed_data, output_csv)
-print("Parsing completed:", output_csv)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract per-scan features from an mzML file.")
+    parser.add_argument('mzml_file')
+    parser.add_argument('output_table', help="output .parquet table, or .csv for the 'N/A' CSV export")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='metadata',
+                        help="'metadata' skips the binary peak arrays, 'pyteomics' decodes every spectrum")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="parse an indexed mzML with N processes (metadata engine only)")
+    args = parser.parse_args()
+    if args.workers > 1 and args.engine != 'metadata':
+        parser.error("--workers is only supported by the metadata engine")
+    profiling.start('mzML-Parser.py', args.mzml_file)
+    # The parsed rows stream straight into the writer, the time spent producing them is the parse section
+    with profiling.streamed('parse', 'write') as timed:
+        if args.engine == 'metadata':
+            parsed_data = parse_mzml_metadata(args.mzml_file, args.workers)
+        else:
+            parsed_data = ENGINES[args.engine](args.mzml_file)
+        write_table(timed(parsed_data), args.output_table)
+    print("Parsing completed:", args.output_table)
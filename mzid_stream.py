@@ -0,0 +1,90 @@
+'''
+Streaming reader for MS-GF+ mzIdentML (.mzid) files, shared by DDA-Report.py and MZid-Parser.py.
+
+The file is walked once with ElementTree.iterparse. Each SpectrumIdentificationResult
+is processed as soon as it is complete, then cleared and detached, so memory stays
+bounded by one result instead of the whole document tree. The q-value filter is
+applied inside the stream and the kept PSMs are returned as NumPy arrays.
+'''
+from array import array
+import xml.etree.ElementTree as ET
+import numpy as np
+
+QVALUE_ACCESSION = 'MS:1002054'  # MS-GF:QValue
+SPEC_EVALUE_ACCESSION = 'MS:1002052'  # MS-GF:SpecEValue
+SCORE_ACCESSIONS = {QVALUE_ACCESSION, SPEC_EVALUE_ACCESSION}
+
+# Elements that are complete records and can be dropped once they have been read
+RECORD_TAGS = {'SpectrumIdentificationResult', 'Peptide', 'PeptideEvidence', 'DBSequence'}
+
+
+def namespace_of(tag):
+    """'{namespace}' prefix of a tag, '' when the document has no namespace."""
+    return tag[:tag.index('}') + 1] if tag.startswith('{') else ''
+
+
+def iter_records(source):
+    """Yield (local tag, element) for every record element, detaching each one after use."""
+    parents = []
+    record_tags = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if record_tags is None:
+                ns = namespace_of(elem.tag)
+                record_tags = {ns + tag: tag for tag in RECORD_TAGS}
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = record_tags.get(elem.tag)
+        if tag is not None:
+            yield tag, elem
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+
+
+def iter_psms(source, q_value_threshold=None):
+    """Yield (retention time, charge, experimental m/z, q-value, spec e-value, peptide) for each PSM.
+
+    Results without a retention time are skipped. With a threshold, only PSMs
+    with a q-value below it are yielded. Missing scores are None.
+    """
+    peptides = {}  # Peptide id -> sequence, the SequenceCollection comes before the results
+    for tag, record in iter_records(source):
+        ns = namespace_of(record.tag)
+        if tag == 'Peptide':
+            peptides[record.get('id')] = record.findtext(ns + 'PeptideSequence')
+            continue
+        if tag != 'SpectrumIdentificationResult':
+            continue
+        cv_tag = ns + 'cvParam'
+        # 'scan start time' of the result, the first one below it as before
+        retention_time = next((float(cv_param.get('value')) for cv_param in record.iter(cv_tag)
+                               if cv_param.get('name') == 'scan start time'), None)
+        if retention_time is None:
+            continue
+        for item in record.iter(ns + 'SpectrumIdentificationItem'):
+            scores = {cv_param.get('accession'): cv_param.get('value') for cv_param in item.iter(cv_tag)
+                      if cv_param.get('accession') in SCORE_ACCESSIONS}
+            q_value = scores.get(QVALUE_ACCESSION)
+            q_value = None if q_value is None else float(q_value)
+            if q_value_threshold is not None and (q_value is None or not q_value < q_value_threshold):
+                continue
+            spec_evalue = scores.get(SPEC_EVALUE_ACCESSION)
+            yield (retention_time, int(item.get('chargeState')), float(item.get('experimentalMassToCharge')),
+                   q_value, None if spec_evalue is None else float(spec_evalue), peptides.get(item.get('peptide_ref')))
+
+
+def read_identifications(file_path, q_value_threshold=0.01):
+    """Return (retention_times, charges, mz_values) NumPy arrays of the PSMs passing the q-value cutoff."""
+    retention_times = array('d')
+    charges = array('l')
+    mz_values = array('d')
+    with open(file_path, 'rb') as source:
+        for retention_time, charge, mz, *_ in iter_psms(source, q_value_threshold):
+            retention_times.append(retention_time)
+            charges.append(charge)
+            mz_values.append(mz)
+    return (np.frombuffer(retention_times, dtype=np.float64),
+            np.frombuffer(charges, dtype=np.int_),
+            np.frombuffer(mz_values, dtype=np.float64))
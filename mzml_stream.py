@@ -0,0 +1,308 @@
+'''
+Streaming helpers for mzML files, shared by the parsing scripts.
+Only the Python standard library is needed. The metadata engine reads the
+scan-level cvParams straight from the XML and never decodes the binary peak arrays,
+so MS-Numpress encoded arrays need no extra support. Gzip-compressed mzML
+(.mzML.gz) is decompressed on the fly by open_mzml, never to disk.
+'''
+import gzip
+import os
+import re
+from contextlib import contextmanager
+import xml.etree.ElementTree as ET
+
+
+class CountingFile:
+    """Wrap a binary file and count the bytes handed to the XML parsers."""
+    def __init__(self, file):
+        self._file = file
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def is_gzip(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(2) == GZIP_MAGIC
+
+
+@contextmanager
+def open_mzml(file_path):
+    """Open a plain or gzip-compressed mzML for streaming.
+
+    Yields (stream, counter): the stream gives the XML bytes, and
+    counter.bytes_read counts the bytes actually read from disk.
+    """
+    with open(file_path, 'rb') as raw:
+        counter = CountingFile(raw)
+        if is_gzip(file_path):
+            with gzip.GzipFile(fileobj=counter, mode='rb') as stream:
+                yield stream, counter
+        else:
+            yield counter, counter
+
+
+def local_name(tag):
+    """Strip the '{namespace}' prefix that ElementTree puts on every tag."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def read_header(source):
+    """PRISM demultiplexing flag ("Yes"/"No") and the run's startTimeStamp (None if absent).
+
+    Both come before the spectra: the userParam is written to the dataProcessingList,
+    which comes before <run>, and the time stamp is an attribute of <run>, so the
+    scan stops as soon as the run element starts.
+    """
+    demultiplexing = "No"
+    for event, elem in ET.iterparse(source, events=('start',)):
+        if elem.tag.endswith('userParam'):  # Check if the element is a userParam tag
+            if elem.attrib.get('name') == 'PRISM Demultiplexing':
+                demultiplexing = "Yes"
+        elif elem.tag == 'run' or elem.tag.endswith('}run'):
+            return demultiplexing, elem.attrib.get('startTimeStamp')  # End of the header, only spectra follow
+    return demultiplexing, None
+
+
+def check_for_prism_demultiplexing(source):
+    """Check for 'PRISM Demultiplexing' in the mzML header using XML parsing."""
+    return read_header(source)[0]
+
+
+def report_throughput(spectra, bytes_read, file_size, elapsed):
+    """Print spectra/s and MB/s. A read ratio of ~1.00x means the file was read once."""
+    elapsed = max(elapsed, 1e-9)
+    megabytes = bytes_read / 1e6
+    print(f"Read {spectra} spectra in {elapsed:.1f} s ({spectra / elapsed:.0f} spectra/s), "
+          f"{megabytes:.1f} MB ({megabytes / elapsed:.1f} MB/s, {bytes_read / max(file_size, 1):.2f}x file size)")
+
+
+def cv_params(elem):
+    """Return {name: value} for the cvParams directly below elem."""
+    return {child.get('name'): child.get('value')
+            for child in elem if local_name(child.tag) == 'cvParam'}
+
+
+def to_float(value):
+    """Convert a cvParam value the way pyteomics does, 'N/A' when it is missing."""
+    if value is None or value == '':
+        return 'N/A'
+    return float(value)
+
+
+def find_child(elem, name):
+    for child in elem:
+        if local_name(child.tag) == name:
+            return child
+    return None
+
+
+def spectrum_rows(spectrum, demultiplexing):
+    """Build the CSV rows for one <spectrum> element, same columns as the pyteomics engine."""
+    rows = []
+    index = int(spectrum.get('index'))
+    params = cv_params(spectrum)
+    scan_list = find_child(spectrum, 'scanList')
+    scan = cv_params(find_child(scan_list, 'scan'))
+    retention_time = to_float(scan.get('scan start time'))
+
+    precursor_list = find_child(spectrum, 'precursorList')
+    precursor = find_child(precursor_list, 'precursor') if precursor_list is not None else None
+    if precursor is not None:
+        window = find_child(precursor, 'isolationWindow')
+        window = cv_params(window) if window is not None else {}
+        selected_ion = find_child(precursor, 'selectedIonList')
+        selected_ion = find_child(selected_ion, 'selectedIon') if selected_ion is not None else None
+        selected_ion = cv_params(selected_ion) if selected_ion is not None else {}
+        rows.append({
+            'Spectrum Index': index,
+            'MS1': False,
+            'Precursor Ion m/z': to_float(selected_ion.get('selected ion m/z')),
+            'Retention Time': retention_time,
+            'Injection Time': to_float(scan.get('ion injection time')),
+            'Isolation Window Target': to_float(window.get('isolation window target m/z')),
+            'Isolation window upper offset': to_float(window.get('isolation window upper offset')),
+            'Isolation window lower offset': to_float(window.get('isolation window lower offset')),
+            'MS1 Base Peak m/z': 'N/A',
+            'Base Peak Intensity': 'N/A',
+            'Total Ion Current': 'N/A',
+            'Demultiplexing': demultiplexing
+        })
+    if params.get('ms level') == '1':
+        rows.append({
+            'Spectrum Index': index,
+            'MS1': True,
+            'Precursor Ion m/z': 'N/A',  # Not applicable for MS1, set as N/A
+            'Retention Time': retention_time,
+            'Injection Time': 'N/A',
+            'Isolation Window Target': 'N/A',
+            'Isolation window upper offset': 'N/A',
+            'Isolation window lower offset': 'N/A',
+            'MS1 Base Peak m/z': to_float(params.get('base peak m/z')),
+            'Base Peak Intensity': to_float(params.get('base peak intensity')),
+            'Total Ion Current': to_float(params.get('total ion current')),
+            'Demultiplexing': demultiplexing
+        })
+    return rows
+
+
+def iter_spectra(source):
+    """Yield (demultiplexing, <spectrum> element) pairs in a single streaming pass.
+
+    The PRISM flag is picked up from the header on the way to the spectra.
+    Peak arrays are dropped as soon as they are parsed and every spectrum is
+    cleared and detached after use, so memory stays at one spectrum.
+    """
+    demultiplexing = "No"
+    spectrum_list = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        tag = local_name(elem.tag)
+        if event == 'start':
+            if tag == 'spectrumList':
+                spectrum_list = elem
+            elif tag == 'userParam' and spectrum_list is None and elem.get('name') == 'PRISM Demultiplexing':
+                demultiplexing = "Yes"
+            continue
+        if tag == 'binaryDataArrayList':
+            elem.clear()  # Peak arrays are never decoded
+        elif tag == 'spectrum':
+            yield demultiplexing, elem
+            elem.clear()
+            if spectrum_list is not None:
+                spectrum_list.remove(elem)
+        elif tag == 'spectrumList':
+            break  # Chromatograms are not needed
+
+
+def iter_isolation_targets(source):
+    """Yield the isolation window target m/z of each spectrum, None if it has no precursor."""
+    for _, spectrum in iter_spectra(source):
+        target = None
+        precursor_list = find_child(spectrum, 'precursorList')
+        precursor = find_child(precursor_list, 'precursor') if precursor_list is not None else None
+        window = find_child(precursor, 'isolationWindow') if precursor is not None else None
+        if window is not None:
+            value = cv_params(window).get('isolation window target m/z')
+            target = float(value) if value else None
+        yield target
+
+
+def parse_metadata(source, stats=None):
+    """Yield the per-scan rows of an mzML file without decoding any peak data.
+
+    If stats is a dict, 'spectra' is set to the number of spectra read.
+    """
+    spectra = 0
+    for demultiplexing, spectrum in iter_spectra(source):
+        spectra += 1
+        yield from spectrum_rows(spectrum, demultiplexing)
+    if stats is not None:
+        stats['spectra'] = spectra
+
+
+################ Offset-sharded parsing of indexed mzML ####################
+MZML_NAMESPACE = 'http://psi.hupo.org/ms/mzml'
+OFFSET_REGEX = re.compile(rb'<offset idRef="[^"]*">(\d+)</offset>')
+
+
+def read_spectrum_offsets(file_path):
+    """Return the byte offsets of all spectra from the indexList.
+
+    Returns None if the file is not indexed or is gzip-compressed, as the offsets
+    then point into the decompressed stream and cannot be seeked to.
+    """
+    if is_gzip(file_path):
+        return None
+    with open(file_path, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(0, size - 4096))
+        match = re.search(rb'<indexListOffset>(\d+)</indexListOffset>', file.read())
+        if match is None:
+            return None
+        file.seek(int(match.group(1)))
+        index = file.read()
+    start = index.find(b'<index name="spectrum">')
+    if start == -1:
+        return None
+    end = index.find(b'</index>', start)
+    return [int(offset) for offset in OFFSET_REGEX.findall(index, start, end)]
+
+
+def find_spectrum_list_end(file_path, last_offset, chunk_size=1 << 20):
+    """Return the byte offset of '</spectrumList>' after the last spectrum."""
+    tag = b'</spectrumList>'
+    with open(file_path, 'rb') as file:
+        file.seek(last_offset)
+        position = last_offset
+        tail = b''
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"No </spectrumList> found in {file_path}")
+            data = tail + chunk
+            found = data.find(tag)
+            if found != -1:
+                return position - len(tail) + found
+            tail = data[-len(tag):]
+            position += len(chunk)
+
+
+def split_shards(offsets, end, shards):
+    """Split the offsets into at most `shards` contiguous (start, end) byte ranges."""
+    shards = max(1, min(shards, len(offsets)))
+    bounds = [offsets[len(offsets) * i // shards] for i in range(shards)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class FileRange:
+    """File-like view of file[start:end], wrapped in a <spectrumList> element for the XML parser."""
+    def __init__(self, file_path, start, end):
+        self._file = open(file_path, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+        self._prefix = f'<spectrumList xmlns="{MZML_NAMESPACE}">'.encode()
+        self._suffix = b'</spectrumList>'
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._remaining + len(self._prefix) + len(self._suffix)
+        data = self._prefix[:size]
+        self._prefix = self._prefix[len(data):]
+        if len(data) < size and self._remaining > 0:
+            chunk = self._file.read(min(size - len(data), self._remaining))
+            self._remaining -= len(chunk)
+            self.bytes_read += len(chunk)
+            data += chunk
+        if len(data) < size and self._remaining == 0:
+            tail = self._suffix[:size - len(data)]
+            self._suffix = self._suffix[len(tail):]
+            data += tail
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def parse_shard(file_path, start, end, demultiplexing):
+    """Parse the spectra in file[start:end]. Returns (rows, spectra, bytes read)."""
+    source = FileRange(file_path, start, end)
+    rows = []
+    spectra = 0
+    try:
+        for _, spectrum in iter_spectra(source):
+            spectra += 1
+            rows.extend(spectrum_rows(spectrum, demultiplexing))
+    finally:
+        source.close()
+    return rows, spectra, source.bytes_read
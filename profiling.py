@@ -0,0 +1,162 @@
+'''
+Opt-in profiling of the Python scripts, off unless PIPELINE_PROFILE is set.
+
+PIPELINE_PROFILE=cprofile,tracemalloc python3 DDA-Report.py ...   (or "all"; the workflow sets it from
+`profile` in config.yaml)
+
+A script calls start(script, name), name being an input or output file of the sample, once its arguments
+are parsed and wraps its phases in section(...). Code that handles many samples in one process, such as a
+worker of Batch-Report.py, profiles each of them with `with profiled(script, name):` instead. With
+profiling on, the files written to PIPELINE_PROFILE_DIR (default profiling/), at exit or at the end of
+the profiled block, are
+    {script}.{name}.prof            cProfile stats, e.g. python3 -m pstats or snakeviz
+    {script}.{name}.tracemalloc.txt peak traced memory and the top allocation sites, taken at the
+                                    end of the section that held the most memory (else at exit)
+    {script}.{name}.sections.tsv    wall time (and traced peak with tracemalloc) per section
+Where rows are streamed from a parser into a writer, streamed(...) splits the block into the time spent
+producing the rows and the rest; both rows carry the block's traced peak. Forked worker processes are
+not profiled separately; their time shows up in the section of the parent that waits for them. With
+profiling off, all of this does nothing.
+'''
+import atexit
+import contextlib
+import cProfile
+import os
+import re
+import time
+import tracemalloc
+
+PROFILERS = ('cprofile', 'tracemalloc')
+TOP_ALLOCATIONS = 30
+
+_state = {'profiler': None, 'tracemalloc': False, 'sections': [], 'prefix': None, 'snapshot': None}
+
+
+def requested_profilers():
+    value = os.environ.get('PIPELINE_PROFILE', '').lower()
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    if names & {'1', 'all', 'true', 'yes'}:
+        return set(PROFILERS)
+    return names & set(PROFILERS)
+
+
+def _begin(profilers, script, name):
+    folder = os.environ.get('PIPELINE_PROFILE_DIR') or 'profiling'
+    os.makedirs(folder, exist_ok=True)
+    label = re.sub(r'[^\w-]+', '_', os.path.basename(name).split('.')[0]) if name else ''  # The sample name
+    _state.update(prefix=os.path.join(folder, os.path.splitext(script)[0] + (f".{label}" if label else '')),
+                  sections=[], snapshot=None)
+    if 'tracemalloc' in profilers:
+        tracemalloc.start()
+        _state['tracemalloc'] = True
+    if 'cprofile' in profilers:
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+
+
+def start(script, name=''):
+    """Start the requested profilers for this run; the dumps are named after the script and name (e.g. the sample)."""
+    profilers = requested_profilers()
+    if not profilers or _state['prefix']:
+        return
+    _begin(profilers, script, name)
+    atexit.register(_write, os.getpid())
+
+
+@contextlib.contextmanager
+def profiled(script, name=''):
+    """Profile the block on its own, e.g. one sample of many handled by a process, and write its dumps at its end.
+    Inside a run already profiled by start() the block is part of that run."""
+    profilers = requested_profilers()
+    if not profilers or _state['prefix']:
+        yield
+        return
+    _begin(profilers, script, name)
+    try:
+        yield
+    finally:
+        _write(os.getpid())
+        _state.update(profiler=None, tracemalloc=False, sections=[], prefix=None, snapshot=None)
+
+
+def _record(name, seconds):
+    peak = None
+    if _state['tracemalloc']:
+        current, peak = tracemalloc.get_traced_memory()
+        if _state['snapshot'] is None or current > _state['snapshot'][1]:
+            _state['snapshot'] = (name, current, tracemalloc.take_snapshot())
+    _state['sections'].append((name, seconds, peak))
+
+
+@contextlib.contextmanager
+def section(name):
+    """Time a phase of the script when profiling is on."""
+    if not _state['prefix']:
+        yield
+        return
+    if _state['tracemalloc']:
+        tracemalloc.reset_peak()
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - begin)
+
+
+@contextlib.contextmanager
+def streamed(producer, consumer):
+    """Time a block that consumes a generator: `with streamed('parse', 'write') as timed: write(timed(rows))`
+    records the time spent in the generator as the producer section and the rest of the block as the consumer."""
+    if not _state['prefix']:
+        yield lambda rows: rows
+        return
+    produced = [0.0]
+
+    def timed(rows):
+        rows = iter(rows)
+        while True:
+            begin = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                produced[0] += time.perf_counter() - begin
+            yield row
+
+    if _state['tracemalloc']:
+        tracemalloc.reset_peak()
+    begin = time.perf_counter()
+    try:
+        yield timed
+    finally:
+        seconds = time.perf_counter() - begin
+        _record(producer, produced[0])
+        _record(consumer, seconds - produced[0])
+
+
+def _write(pid):
+    if os.getpid() != pid:
+        return  # A forked worker that exits normally
+    prefix = _state['prefix']
+    if _state['profiler']:
+        _state['profiler'].disable()
+        _state['profiler'].dump_stats(prefix + '.prof')
+    if _state['tracemalloc']:
+        # Section peaks were reset at each section start, the run's peak is the largest of them
+        peak = max([tracemalloc.get_traced_memory()[1]] + [peak for _, _, peak in _state['sections']])
+        where, current, snapshot = _state['snapshot'] or ('exit', None, tracemalloc.take_snapshot())
+        statistics = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ]).statistics('lineno')
+        tracemalloc.stop()
+        with open(prefix + '.tracemalloc.txt', 'w') as file:
+            file.write(f"Peak traced memory: {peak / 1e6:.1f} MB\n")
+            file.write(f"Top {TOP_ALLOCATIONS} allocation sites at the end of section {where}"
+                       + (f" ({current / 1e6:.1f} MB allocated):\n" if current is not None else ":\n"))
+            for statistic in statistics[:TOP_ALLOCATIONS]:
+                file.write(f"{statistic}\n")
+    with open(prefix + '.sections.tsv', 'w') as file:
+        file.write("section\tseconds\ttraced_peak_mb\n")
+        for name, seconds, peak in _state['sections']:
+            file.write(f"{name}\t{seconds:.3f}\t{'' if peak is None else f'{peak / 1e6:.1f}'}\n")
@@ -0,0 +1,134 @@
+'''
+Columnar cache of every PSM in an MS-GF+ .mzid, so reports at any FDR are a
+filter over a small table instead of another XML parse.
+
+The first read streams the mzid once (mzid_stream.iter_psms, no q-value cutoff)
+and writes {sample}.mzid.psms.parquet next to it. The Parquet metadata records the
+SHA-256 of the mzid it came from, plus its size and mtime as a fast path: when
+those still match the hash is not recomputed, when they changed the mzid is hashed
+and the cache rebuilt only if the content really differs.
+'''
+from array import array
+import hashlib
+import os
+import tempfile
+from mzid_stream import iter_psms
+
+CACHE_SUFFIX = '.psms.parquet'
+PSM_COLUMNS = ['Retention Time', 'Charge', 'm/z', 'QValue', 'SpecEValue', 'Peptide']
+DEFAULT_FDR = 0.01
+CHUNK_ROWS = 100_000
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(mzid_file):
+    return mzid_file + CACHE_SUFFIX
+
+
+def _source_key(mzid_file, sha256):
+    stat = os.stat(mzid_file)
+    return {b'mzid_sha256': sha256.encode(),
+            b'mzid_size': str(stat.st_size).encode(),
+            b'mzid_mtime_ns': str(stat.st_mtime_ns).encode()}
+
+
+def _schema(key=None):
+    import pyarrow as pa
+    return pa.schema([
+        ('Retention Time', pa.float64()),
+        ('Charge', pa.int64()),
+        ('m/z', pa.float64()),
+        ('QValue', pa.float64()),
+        ('SpecEValue', pa.float64()),
+        ('Peptide', pa.string()),
+    ], metadata=key)
+
+
+def _nan_if_none(value):
+    return float('nan') if value is None else value
+
+
+def write_cache(mzid_file, cache_file, sha256=None):
+    """Extract all PSMs from the mzid into cache_file, one row group per CHUNK_ROWS PSMs."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema(_source_key(mzid_file, sha256 or file_sha256(mzid_file)))
+    # A temporary file of its own, so concurrent writers of the same cache never share a half-written file
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), suffix='.tmp')
+    os.close(fd)
+    try:
+        with open(mzid_file, 'rb') as source, pq.ParquetWriter(tmp_file, schema) as writer:
+            def flush(columns):
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+
+            columns = [array('d'), array('q'), array('d'), array('d'), array('d'), []]
+            for psm in iter_psms(source):
+                retention_time, charge, mz, q_value, spec_evalue, peptide = psm
+                columns[0].append(retention_time)
+                columns[1].append(charge)
+                columns[2].append(mz)
+                columns[3].append(_nan_if_none(q_value))
+                columns[4].append(_nan_if_none(spec_evalue))
+                columns[5].append(peptide)
+                if len(columns[5]) == CHUNK_ROWS:
+                    flush(columns)
+                    columns = [array('d'), array('q'), array('d'), array('d'), array('d'), []]
+            if columns[5]:
+                flush(columns)
+        os.chmod(tmp_file, 0o644)  # mkstemp creates it private to the user
+        os.replace(tmp_file, cache_file)  # Never leave a half-written cache behind
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def _cache_is_current(mzid_file, cache_file):
+    """Return (current, sha256 of the mzid if it had to be computed)."""
+    import pyarrow.parquet as pq
+
+    if not os.path.exists(cache_file):
+        return False, None
+    metadata = pq.read_schema(cache_file).metadata or {}
+    if b'mzid_sha256' not in metadata:
+        return False, None
+    stat = os.stat(mzid_file)
+    if (metadata.get(b'mzid_size') == str(stat.st_size).encode()
+            and metadata.get(b'mzid_mtime_ns') == str(stat.st_mtime_ns).encode()):
+        return True, None
+    sha256 = file_sha256(mzid_file)
+    return metadata[b'mzid_sha256'] == sha256.encode(), sha256
+
+
+def load_psms(mzid_file, columns=None):
+    """All PSMs of the mzid as a DataFrame, (re)building the cache when needed."""
+    import pandas as pd
+
+    cache_file = cache_path(mzid_file)
+    current, sha256 = _cache_is_current(mzid_file, cache_file)
+    if not current:
+        try:
+            write_cache(mzid_file, cache_file, sha256)
+        except OSError as error:
+            # A read-only results folder: extract to a temporary file instead
+            print(f"Could not write the PSM cache {cache_file}: {error}")
+            with tempfile.TemporaryDirectory() as tmp:
+                tmp_cache = os.path.join(tmp, os.path.basename(cache_file))
+                write_cache(mzid_file, tmp_cache, sha256)
+                return pd.read_parquet(tmp_cache, columns=columns)
+    return pd.read_parquet(cache_file, columns=columns)
+
+
+def read_identifications(mzid_file, q_value_threshold=DEFAULT_FDR):
+    """Return (retention_times, charges, mz_values) NumPy arrays of the PSMs with QValue below the threshold."""
+    psms = load_psms(mzid_file, ['Retention Time', 'Charge', 'm/z', 'QValue'])
+    psms = psms[psms['QValue'] < q_value_threshold]
+    return psms['Retention Time'].to_numpy(), psms['Charge'].to_numpy(), psms['m/z'].to_numpy()
@@ -0,0 +1,152 @@
+'''
+Longitudinal QC trends over the per-run metrics of sample_metrics / metrics_store.
+
+Runs are ordered by their start time (the mzML startTimeStamp from the .acqmode.tsv
+sidecar; runs without one come last, by sample name) and compared within their
+series, the sample key and acquisition mode, e.g. the daily 'HeLa_50ng_' DIA standard.
+Each run is compared to the trailing window of the runs before it: the baseline is
+their median and the spread their MAD, both computed for all runs at once on a
+sliding window view of the series. A run is an outlier when its robust z-score
+0.6745 * (value - median) / MAD is above the threshold, or, for the isolation window
+count of a DIA series, when it differs from the baseline at all (a change of the
+window scheme). The isolation window count of a DDA run is the number of distinct
+precursor targets in its first MS2 scans, which varies from run to run, so it is not
+trended.
+'''
+import warnings
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from numpy.lib.stride_tricks import sliding_window_view
+
+TREND_METRICS = ['ms1_scans', 'ms2_scans', 'precursors_identified', 'median_injection_time', 'isolation_windows']
+METRIC_LABELS = {
+    'ms1_scans': 'MS1 scans',
+    'ms2_scans': 'MS2 scans',
+    'precursors_identified': 'Precursors identified',
+    'median_injection_time': 'Median injection time (ms)',
+    'isolation_windows': 'Isolation windows',
+}
+# Metrics that are flagged on any change from the baseline instead of on the z-score,
+# only trended for the series of SCHEME_MODES
+SCHEME_METRICS = ['isolation_windows']
+SCHEME_MODES = ['DIA']
+SERIES_COLUMNS = ['key', 'mode']
+OUTLIER_COLUMNS = ['sample', 'run_start', 'key', 'mode', 'metric', 'value', 'baseline', 'mad', 'z']
+
+WINDOW = 20
+MIN_PERIODS = 10
+Z_THRESHOLD = 3.5
+
+
+def run_table(scan_metrics, identified_metrics):
+    """One row per run with its series and TREND_METRICS, in run order."""
+    runs = pd.DataFrame(scan_metrics, columns=['sample', 'key', 'mode', 'nanogram', 'run_start', 'ms1_scans',
+                                               'ms2_scans', 'median_injection_time', 'isolation_windows'])
+    identified = pd.DataFrame(identified_metrics, columns=['sample', 'precursors_identified'])
+    identified = identified[identified['precursors_identified'] != -1]  # -1: no identifications for this mode
+    runs = runs.merge(identified.groupby('sample', as_index=False)['precursors_identified'].max(),
+                      on='sample', how='left')
+    runs['run_start'] = pd.to_datetime(runs['run_start'], utc=True, errors='coerce')
+    return runs.sort_values(['run_start', 'sample'], na_position='last', ignore_index=True)
+
+
+def trailing_median_mad(values, window=WINDOW, min_periods=MIN_PERIODS):
+    """Median and MAD of the `window` values before each value (NaN ignored).
+
+    Both are NaN where fewer than min_periods earlier values are available.
+    """
+    values = np.asarray(values, dtype=float)
+    padded = np.concatenate([np.full(window, np.nan), values[:-1]])
+    windows = sliding_window_view(padded, window)  # windows[i] = values[i - window:i]
+    enough = (~np.isnan(windows)).sum(axis=1) >= min_periods
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN windows, masked below
+        median = np.nanmedian(windows, axis=1)
+        mad = np.nanmedian(np.abs(windows - median[:, None]), axis=1)
+    median[~enough] = np.nan
+    mad[~enough] = np.nan
+    return median, mad
+
+
+def robust_z(values, median, mad):
+    """0.6745 * (value - median) / MAD; with a MAD of 0 any deviation is infinite."""
+    deviation = np.asarray(values, dtype=float) - median
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(mad > 0, 0.6745 * deviation / mad, np.where(deviation == 0, 0.0, np.inf * np.sign(deviation)))
+    return np.where(np.isnan(median) | np.isnan(deviation), np.nan, z)
+
+
+def add_baselines(runs, window=WINDOW, min_periods=MIN_PERIODS):
+    """Add <metric>_baseline, <metric>_mad and <metric>_z columns, computed per series.
+
+    The SCHEME_METRICS columns stay NaN for the series of other modes than SCHEME_MODES.
+    """
+    runs = runs.copy()
+    for metric in TREND_METRICS:
+        for suffix in ('_baseline', '_mad', '_z'):
+            runs[metric + suffix] = np.nan
+    for (_, mode), index in runs.groupby(SERIES_COLUMNS, dropna=False).groups.items():
+        series = runs.loc[index]
+        for metric in TREND_METRICS:
+            if metric in SCHEME_METRICS and mode not in SCHEME_MODES:
+                continue
+            median, mad = trailing_median_mad(series[metric].to_numpy(dtype=float), window, min_periods)
+            runs.loc[index, metric + '_baseline'] = median
+            runs.loc[index, metric + '_mad'] = mad
+            runs.loc[index, metric + '_z'] = robust_z(series[metric], median, mad)
+    return runs
+
+
+def flagged_runs(runs, metric, threshold=Z_THRESHOLD):
+    """Boolean mask of the runs that are outliers for one metric."""
+    if metric in SCHEME_METRICS:
+        # Any change of the window scheme, the value compared exactly with the baseline
+        baseline = runs[metric + '_baseline']
+        return baseline.notna() & runs[metric].notna() & (runs[metric] != baseline)
+    return runs[metric + '_z'].abs() > threshold
+
+
+def find_outliers(runs, threshold=Z_THRESHOLD):
+    """Long table (OUTLIER_COLUMNS) of every flagged run and metric, in run order."""
+    outliers = []
+    for metric in TREND_METRICS:
+        flagged = flagged_runs(runs, metric, threshold)
+        if flagged.any():
+            rows = runs.loc[flagged, ['sample', 'run_start', 'key', 'mode', metric,
+                                      metric + '_baseline', metric + '_mad', metric + '_z']]
+            rows.columns = ['sample', 'run_start', 'key', 'mode', 'value', 'baseline', 'mad', 'z']
+            rows.insert(4, 'metric', metric)
+            outliers.append(rows)
+    if not outliers:
+        return pd.DataFrame(columns=OUTLIER_COLUMNS)
+    return pd.concat(outliers).sort_index(kind='stable')[OUTLIER_COLUMNS]
+
+
+def write_outliers(outliers, file_path):
+    outliers.to_csv(file_path, sep='\t', index=False, date_format='%Y-%m-%dT%H:%M:%SZ')
+
+
+def draw_trends(runs, window=WINDOW, threshold=Z_THRESHOLD):
+    """One small panel per metric: every run, the trailing median per series and the outliers in red."""
+    figure = plt.gcf()
+    figure.set_size_inches(11, 2 + 1.6 * len(TREND_METRICS))
+    axes = figure.subplots(len(TREND_METRICS), 1, sharex=True)
+    # Run start on the x axis when every run has one, otherwise the run order
+    by_time = len(runs) > 0 and runs['run_start'].notna().all()
+    x = runs['run_start'] if by_time else pd.Series(np.arange(len(runs)))
+    for ax, metric in zip(axes, TREND_METRICS):
+        for (key, mode), index in runs.groupby(SERIES_COLUMNS, dropna=False).groups.items():
+            if metric in SCHEME_METRICS and mode not in SCHEME_MODES:
+                continue
+            series = runs.loc[index]
+            points = ax.plot(x[index], series[metric], '.', markersize=3, label=f"{key} {mode}")[0]
+            ax.plot(x[index], series[metric + '_baseline'], '-', linewidth=1, color=points.get_color())
+        flagged = flagged_runs(runs, metric, threshold)
+        ax.plot(x[flagged], runs.loc[flagged, metric], 'o', markersize=5, markerfacecolor='none', color='red')
+        ax.set_ylabel(METRIC_LABELS[metric], fontsize=8)
+        ax.tick_params(labelsize=7)
+    axes[0].set_title(f"QC trends, {len(runs)} runs: trailing {window}-run median, outliers (|z| > {threshold}) in red")
+    axes[0].legend(loc='upper left', bbox_to_anchor=(1, 1), fontsize=7)
+    axes[-1].set_xlabel('Run start' if by_time else 'Run')
+    figure.tight_layout()
@@ -0,0 +1,304 @@
+'''
+Per-sample QC report (PDF page plus isolation window table) shared by DDA-Report.py,
+DIA-Report.py and Batch-Report.py.
+
+The page is the same for both acquisition modes: a few summary lines, the scan and
+injection time metrics, the identified precursors and four RT vs m/z plots (Dinosaur
+features, then identifications). What differs lives in a section function registered
+in SECTIONS: it reads the mode specific inputs and returns the header lines, the
+identified precursors, the identified RT/m/z values and the window table.
+
+A sample is a dict with the keys of MANIFEST_COLUMNS; only the ones its section uses
+need to be filled in.
+'''
+import csv
+import numpy as np
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from scan_table import read_scan_table
+from dinosaur_features import load_features
+from report_plots import draw_rt_mz, png_image, render_pngs
+from psm_cache import DEFAULT_FDR, read_identifications
+from diann_join import join_library_report
+from worker_pool import process_pool
+import profiling
+
+MANIFEST_COLUMNS = ['sample', 'mode', 'scan_table', 'dinosaur_features', 'mzid',
+                    'diann_stats', 'diann_library', 'diann_report', 'pdf', 'table']
+DEFAULT_OPTIONS = {'fdr': DEFAULT_FDR, 'plot_mode': 'auto'}
+
+WINDOW_COLUMNS = ['Isolation Window Target', 'Isolation window upper offset', 'Isolation window lower offset']
+
+
+def scan_summary(scans):
+    """MS1/MS2 scan counts and injection time statistics of the per-scan table."""
+    scan_number_MS1 = int(scans['MS1'].sum())
+    injection_times = scans['Injection Time'].dropna().to_numpy()
+    return {
+        'scan_number_MS1': scan_number_MS1,
+        'scan_number_MSMS': len(scans) - scan_number_MS1,
+        'average_injection_time': np.mean(injection_times),
+        'median_injection_time': np.median(injection_times),
+    }
+
+
+def dda_section(sample, options):
+    scans = read_scan_table(sample['scan_table'], ['MS1', 'Injection Time'] + WINDOW_COLUMNS)
+
+    # Calculate window size for the scans with a complete isolation window
+    windows = scans.dropna(subset=WINDOW_COLUMNS)
+    targets = windows['Isolation Window Target'].to_numpy()
+    upper_offsets = windows['Isolation window upper offset'].to_numpy()
+    lower_offsets = windows['Isolation window lower offset'].to_numpy()
+    average_lower_bound = np.mean(targets - lower_offsets)
+    average_upper_bound = np.mean(targets + upper_offsets)
+
+    # Last seen offsets for each target, in order of first appearance
+    last_windows = windows.groupby('Isolation Window Target', sort=False).last()
+    target_details = {
+        target: {
+            'upper_offset': row['Isolation window upper offset'],
+            'lower_offset': row['Isolation window lower offset'],
+            'window_size': row['Isolation window upper offset'] + row['Isolation window lower offset']
+        }
+        for target, row in last_windows.iterrows()
+    }
+
+    # PSMs with MS-GF:QValue below the FDR cutoff, from the PSM cache next to the mzid
+    retention_times, charges, mz_values = read_identifications(sample['mzid'], q_value_threshold=options['fdr'])
+
+    return {
+        'font_size': 11,
+        'header': [
+            "DDA sample.",
+            f"Number of distinct isolation windows used: {len(set(targets))}",
+            f"Window Size: {average_upper_bound - average_lower_bound:.2f}",
+        ],
+        'scans': scan_summary(scans),
+        'precursors_identified': len(retention_times),
+        'identified': (retention_times, mz_values),
+        'identified_high_charge': (retention_times[charges >= 2], mz_values[charges >= 2]),
+        'identified_titles': ('All Charges (Identified features, MSGFPlus)',
+                              'Charge ≥ 2 (Identified features, MSGFPlus)'),
+        'target_details': target_details,
+    }
+
+
+def dia_section(sample, options):
+    scans = read_scan_table(sample['scan_table'], ['MS1', 'Injection Time'] + WINDOW_COLUMNS + ['Demultiplexing'])
+
+    windows = scans.dropna(subset=WINDOW_COLUMNS)
+    window_sizes = (windows['Isolation window upper offset'] + windows['Isolation window lower offset']).round(1)
+    # Check for demultiplexing signal in the data and adjust window size
+    demultiplexing_applied = bool(windows['Demultiplexing'].any())
+    window_sizes = window_sizes.where(~windows['Demultiplexing'], window_sizes * 2)  # Double the size if demultiplexed
+    windows = windows.assign(window_size=window_sizes)
+
+    # Store details for each target: last seen values, in order of first appearance
+    last_windows = windows.groupby('Isolation Window Target', sort=False).last()
+    target_details = {
+        target: {
+            'upper_offset': row['Isolation window upper offset'],
+            'lower_offset': row['Isolation window lower offset'],
+            'window_size': row['window_size']
+        }
+        for target, row in last_windows.iterrows()
+    }
+    window_sizes_by_target = last_windows['window_size'].to_dict()  # Store window size for each target
+
+    window_size_counts = {}
+    for size in window_sizes_by_target.values():
+        if size not in window_size_counts:
+            window_size_counts[size] = 0
+        window_size_counts[size] += 1
+
+    num_isolation_windows = len(window_sizes_by_target)
+    if demultiplexing_applied:
+        # Adjust the count of each window size based on the new total number of targets
+        adjustment_factor = (num_isolation_windows - 2) // 2
+        adjusted_window_size_counts = {}
+        for size, count in window_size_counts.items():
+            # Reduce the original count proportionally based on the adjustment factor
+            adjusted_count = max(1, count * adjustment_factor // num_isolation_windows)
+            adjusted_window_size_counts[size] = adjusted_count
+        window_size_counts = adjusted_window_size_counts  # Use the adjusted counts for summary
+        num_isolation_windows = adjustment_factor  # Update the total number of isolation windows
+
+    # Generate the summary of window sizes with corrected target counts
+    window_size_summary = "; ".join(f"{size} for {count} windows" for size, count in window_size_counts.items())
+
+    precursors_identified = 0
+    # Read data from the DIA-NN stats file
+    with open(sample['diann_stats'], newline='') as file:
+        tsv_reader = csv.DictReader(file, delimiter='\t')  # TSV files use tab delimiters
+        for row in tsv_reader:
+            precursors_identified = row['Precursors.Identified']
+
+    # RT vs precursor m/z of the identifications, joined in chunks from the DIA-NN library and main report
+    retention_times, precursor_mz, precursor_charge = join_library_report(sample['diann_library'], sample['diann_report'])
+    high_charge = precursor_charge >= 2
+
+    demultiplexing_status = "DIA sample using overlapping windows and demultiplexing after" if demultiplexing_applied else "DIA sample"
+    return {
+        'font_size': 12,
+        'header': [
+            f"{demultiplexing_status}.",
+            f"Number of distinct isolation windows used: {num_isolation_windows}",
+            f"Detailed Window Size: {window_size_summary}",
+        ],
+        'scans': scan_summary(scans),
+        'precursors_identified': precursors_identified,
+        'identified': (retention_times, precursor_mz),
+        'identified_high_charge': (retention_times[high_charge], precursor_mz[high_charge]),
+        'identified_titles': ('All Charges (Identified features, Dia-NN)',
+                              'Charge ≥ 2 (Identified features, Dia-NN) '),
+        'target_details': target_details,
+    }
+
+
+SECTIONS = {'DDA': dda_section, 'DIA': dia_section}
+
+
+def plot_jobs(sample, section, options):
+    """render_pngs jobs for the four RT vs m/z plots of the page."""
+    # Dinosaur features: m/z and retention time of all features and of those with charge >= 2
+    feature_rt, feature_mz, high_charge = load_features(sample['dinosaur_features'], cache=True)
+    feature_style = {'s': 0.1, 'color': 'blue'}
+    identified_style = {'alpha': 0.5, 's': 0.5}
+    all_title, high_charge_title = section['identified_titles']
+    plot_mode = options['plot_mode']
+    png_options = {'rc': {'font.size': section['font_size']}}
+    return [
+        # Plot 1: RetentionTime vs M/Z (All Features)
+        (draw_rt_mz, (feature_rt, feature_mz, 'RetentionTime and m/z (All Features)', 'RetentionTime', 'm/z',
+                      False, plot_mode, feature_style), png_options),
+        # Plot 2: RetentionTime vs m/z (Charge >= 2)
+        (draw_rt_mz, (feature_rt[high_charge], feature_mz[high_charge], 'Retention Time and m/z (Charge >= 2)',
+                      'Retention Time', 'm/z', False, plot_mode, feature_style), png_options),
+        # Plot 3: All charges of the identifications
+        (draw_rt_mz, (*section['identified'], all_title, 'Retention Time (RT)', 'Precursor m/z',
+                      True, plot_mode, identified_style), png_options),
+        # Plot 4: Charge ≥ 2 of the identifications
+        (draw_rt_mz, (*section['identified_high_charge'], high_charge_title, 'Retention Time (RT)', 'Precursor m/z',
+                      True, plot_mode, identified_style), png_options),
+    ]
+
+
+def write_pdf(report_file, section, pngs):
+    c = canvas.Canvas(report_file, pagesize=letter)
+    width, height = letter
+
+    scans = section['scans']
+    text_lines = section['header'] + [
+        "",
+        f"Average Injection Time: {scans['average_injection_time']:.2f} ms",
+        f"Median Injection Time: {scans['median_injection_time']:.2f} ms",
+        "",
+        f"Precursors Identified: {section['precursors_identified']}",
+        "",
+        f"Number of MS1 scans: {scans['scan_number_MS1']}",
+        f"Number of MS/MS scans: {scans['scan_number_MSMS']}",
+    ]
+    # Define starting Y position for text
+    current_y = height - 72  # Starting Y position at the top of the page
+    # Set a fixed amount to decrement the Y position for each line
+    line_height = 14
+    for line in text_lines:
+        c.drawString(72, current_y, line)
+        current_y -= line_height
+
+    current_y -= 30  # Additional space before starting images
+
+    image_positions = []  # To store calculated positions and sizes for each image
+    for i, png in enumerate(pngs):
+        image = png_image(png)
+        aspect_ratio = image.getSize()[0] / float(image.getSize()[1])
+
+        # Calculate image width and height based on desired width or max height
+        image_width = (width - 144) / 2  # Two images per row, with margins
+        image_height = image_width / aspect_ratio
+
+        # Calculate X, Y positions for the current image
+        x = 72 + (i % 2) * (width / 2)
+        y = current_y - (i // 2 + 1) * image_height - 10 * (i // 2)  # Adjust Y based on row
+
+        image_positions.append((image, x, y, image_width, image_height))
+
+        # Update current_y for the first image only, to avoid reducing it for every image
+        if i == 1 or i == 3:  # After drawing two images in a row
+            current_y = y + 150  # Adjust space for next row of images
+
+    # Draw images on the PDF using calculated positions and sizes
+    for image, x, y, image_width, image_height in image_positions:
+        c.drawImage(image, x, y, width=image_width, height=image_height)
+    c.save()
+
+
+def write_window_table(table_file, target_details):
+    # Prepare the header and data rows for the table
+    data = [['Target', 'Upper Window', 'Lower Window', 'Window Size']]
+    for target, details in target_details.items():
+        data.append([target, details['upper_offset'], details['lower_offset'], details['window_size']])
+    with open(table_file, 'w', newline='') as csvfile:
+        csv.writer(csvfile).writerows(data)
+
+
+def write_report(sample, options=None, plot_workers=1):
+    """Write the PDF page and the window table of one sample."""
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    with profiling.section('load'):
+        section = SECTIONS[sample['mode']](sample, options)
+    with profiling.section('plot'):
+        pngs = render_pngs(plot_jobs(sample, section, options), plot_workers)  # PNG bytes, nothing is written to disk
+    with profiling.section('pdf'):
+        write_pdf(sample['pdf'], section, pngs)
+        write_window_table(sample['table'], section['target_details'])
+
+
+def _write_report_job(job):
+    sample, options, plot_workers = job
+    try:
+        with profiling.profiled('Batch-Report.py', sample['pdf']):
+            write_report(sample, options, plot_workers)
+        return sample['sample'], None
+    except Exception as error:
+        return sample['sample'], f"{type(error).__name__}: {error}"
+
+
+def write_reports(samples, options=None, workers=1, plot_workers=4):
+    """Write the reports of many samples from this process or a pool of worker processes.
+
+    A failing sample does not stop the others. With one worker the plots of each
+    report are rendered in parallel instead. Returns {sample: error} for the failures.
+    """
+    if workers > 1:
+        jobs = [(sample, options, 1) for sample in samples]
+        with process_pool(workers) as pool:
+            results = list(pool.map(_write_report_job, jobs))
+    else:
+        results = [_write_report_job((sample, options, plot_workers)) for sample in samples]
+    return {name: error for name, error in results if error is not None}
+
+
+def read_manifest(manifest_file):
+    """Samples of a tab-separated manifest with a header of MANIFEST_COLUMNS.
+
+    The mode column is DDA, DIA or the path of the sample's .acqmode.tsv sidecar.
+    """
+    from acquisition_mode import read_sidecar
+
+    samples = []
+    with open(manifest_file, newline='') as file:
+        for row in csv.DictReader(file, delimiter='\t'):
+            sample = {column: row.get(column) or None for column in MANIFEST_COLUMNS}
+            if sample['mode'] not in SECTIONS:
+                sample['mode'] = read_sidecar(sample['mode'])['mode']
+            samples.append(sample)
+    return samples
+
+
+def write_manifest(manifest_file, samples):
+    with open(manifest_file, 'w', newline='') as file:
+        writer = csv.DictWriter(file, MANIFEST_COLUMNS, delimiter='\t', extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(samples)
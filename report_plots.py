@@ -0,0 +1,90 @@
+'''
+Figures for the report scripts, rendered to PNG bytes in memory.
+
+Below DENSITY_THRESHOLD points the plot is the usual scatter. Above it the points
+are binned into a fixed RT x m/z grid with NumPy and drawn as a single image, so
+the rendering time depends on the number of bins and not on the number of
+features or PSMs. The mode can also be forced with 'scatter' or 'density'.
+
+render_pngs draws independent figures in worker processes (worker_pool.py) with the
+Agg backend and returns the PNG bytes, which go to reportlab through ImageReader
+without any temporary file.
+'''
+import io
+import os
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+from reportlab.lib.utils import ImageReader
+from worker_pool import process_pool
+
+PLOT_MODES = ('auto', 'scatter', 'density')
+DENSITY_THRESHOLD = 200_000
+DENSITY_BINS = (400, 300)  # retention time, m/z
+
+
+def use_density(n_points, mode='auto', threshold=DENSITY_THRESHOLD):
+    return mode == 'density' or (mode == 'auto' and n_points > threshold)
+
+
+def rt_mz_plot(retention_times, mz_values, mode='auto', threshold=DENSITY_THRESHOLD, **scatter_kwargs):
+    """Draw RT vs m/z on the current axes as a scatter or, for many points, a density image."""
+    retention_times = np.asarray(retention_times, dtype=float)
+    mz_values = np.asarray(mz_values, dtype=float)
+    if not use_density(len(retention_times), mode, threshold) or len(retention_times) == 0:
+        plt.scatter(retention_times, mz_values, **scatter_kwargs)
+        return
+
+    counts, rt_edges, mz_edges = np.histogram2d(retention_times, mz_values, bins=DENSITY_BINS)
+    image = plt.imshow(np.ma.masked_equal(counts.T, 0), origin='lower', aspect='auto', interpolation='nearest',
+                       extent=(rt_edges[0], rt_edges[-1], mz_edges[0], mz_edges[-1]),
+                       cmap='viridis', norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)))
+    plt.colorbar(image, label='Count per bin')
+
+
+def draw_rt_mz(retention_times, mz_values, title, xlabel, ylabel, grid=False, mode='auto', scatter_kwargs=None):
+    """One RT vs m/z report plot on the current figure."""
+    rt_mz_plot(retention_times, mz_values, mode=mode, **(scatter_kwargs or {}))
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    if grid:
+        plt.grid(True)
+
+
+def figure_png(draw, args=(), rc=None, **savefig_kwargs):
+    """Call draw(*args) on a new figure, with rc as temporary rcParams, and return it as PNG bytes."""
+    with plt.rc_context(rc):
+        figure = plt.figure()
+        try:
+            draw(*args)
+            buf = io.BytesIO()
+            plt.savefig(buf, format='png', **savefig_kwargs)
+        finally:
+            plt.close(figure)
+    return buf.getvalue()
+
+
+def _figure_png_job(job):
+    draw, args, options = job
+    return figure_png(draw, args, **options)
+
+
+def render_pngs(jobs, workers=None):
+    """Render (draw, args, options) jobs to PNG bytes, in parallel when workers > 1.
+
+    draw must be defined at module level, in a module or in a script that keeps its
+    work under if __name__ == "__main__".
+    """
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers > 1:
+        with process_pool(workers) as pool:
+            return list(pool.map(_figure_png_job, jobs))
+    return [_figure_png_job(job) for job in jobs]
+
+
+def png_image(png):
+    """reportlab image from PNG bytes."""
+    return ImageReader(io.BytesIO(png))
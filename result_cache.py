@@ -0,0 +1,251 @@
+'''
+Content-addressed cache of workflow stage outputs, shared between projects and
+output folders.
+
+python3 result_cache.py CACHE_DIR --stage feat_extraction --inputs in.mzML [--tool=dinosaur.jar]
+    [--param="--minCharge=2" ...] [--max-gb 500] --outputs out.features.tsv -- java -jar dinosaur.jar ...
+
+An entry is keyed by the SHA-256 of the stage name, the parameters, the content of
+every input file and the tools (the file content of a jar or executable, otherwise
+the given string, e.g. a container image tag), not by any path. On a miss the command
+runs and its outputs are copied into the cache (by reflink where the filesystem
+supports it) as read-only files; the job's own outputs are never linked into it. On
+a hit the cached outputs are materialized at the requested paths by reflink, else by
+hardlink, else by copy, and the command is not run. Reflinks and copies are ordinary
+writable files. A hardlink is the cache object itself and stays read-only; an object
+that was made writable through one of its links is no longer trusted, its entry is
+dropped and the lookup is a miss. An entry evicted by another process during a lookup
+is a miss as well. A hit creates the file named by PIPELINE_CACHE_HIT_FILE, when set,
+so stage_telemetry.py can tell a materialized job from a computed one.
+
+File hashes are remembered by path, size and mtime in the cache index, so an
+unchanged input is hashed once. The index (SQLite, WAL mode) records the size and
+last use of every entry; when the cache grows over its size cap the least recently
+used entries are evicted.
+'''
+import argparse
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from psm_cache import file_sha256
+from stage_telemetry import HIT_MARKER_ENV
+
+BUSY_TIMEOUT_S = 120
+FICLONE = 0x40049409  # Linux ioctl that reflinks a whole file (Btrfs, XFS)
+OBJECT_MODE = 0o444  # Cache objects, and the hardlinks to them
+OUTPUT_MODE = 0o644  # Reflinked or copied outputs
+WRITE_BITS = 0o222
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+'''
+
+
+def log(message):
+    print(f"result_cache: {message}", file=sys.stderr, flush=True)
+
+
+def is_read_only(path):
+    return not os.stat(path).st_mode & WRITE_BITS
+
+
+def clone(source, destination, mode, copy=True):
+    """Make destination an independent copy of source with the given mode, by reflink where the filesystem
+    supports it, else by copy unless copy is False. Returns the method used, None if nothing was made."""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        method = 'reflink'
+    except FileNotFoundError:
+        raise  # The source is gone, e.g. evicted
+    except OSError:
+        os.remove(destination)
+        if not copy:
+            return None
+        shutil.copyfile(source, destination)
+        method = 'copy'
+    shutil.copystat(source, destination)
+    os.chmod(destination, mode)
+    return method
+
+
+def materialize(source, destination):
+    """Make destination a copy of the read-only cache object source, sharing the data blocks where possible:
+    a writable reflink, else a hardlink to the object (read-only), else a writable copy. Returns the method used."""
+    method = clone(source, destination, OUTPUT_MODE, copy=False)
+    if method:
+        return method
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except FileNotFoundError:
+        raise
+    except OSError:
+        return clone(source, destination, OUTPUT_MODE)
+
+
+def unshare(outputs):
+    """Remove the outputs that are hardlinks, so a command run after a miss does not write into files shared
+    with the cache or other projects. Returns False, the result of the lookup."""
+    for output in outputs:
+        if os.path.isfile(output) and os.stat(output).st_nlink > 1:
+            os.remove(output)
+    return False
+
+
+class ResultCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), timeout=BUSY_TIMEOUT_S)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def file_hash(self, path):
+        """SHA-256 of a file, recomputed only when its size or mtime changed."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        sha256 = file_sha256(path)
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                              (path, stat.st_size, stat.st_mtime_ns, sha256))
+        return sha256
+
+    def tool_id(self, tool):
+        """Content hash of a tool file (path or command on PATH), else the string itself."""
+        path = tool if os.path.isfile(tool) else shutil.which(tool)
+        return self.file_hash(path) if path else tool
+
+    def key(self, stage, inputs, tools=(), params=()):
+        digest = hashlib.sha256()
+        for part in ([stage] + [f"param:{param}" for param in params] + [f"tool:{self.tool_id(tool)}" for tool in tools]
+                     + [f"input:{self.file_hash(path)}" for path in inputs]):
+            digest.update(part.encode() + b'\0')
+        return digest.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, 'objects', key[:2], key)
+
+    def lookup(self, key, outputs):
+        """Materialize a cached entry at the output paths; False when it is not cached."""
+        entry = self.entry_dir(key)
+        objects = [os.path.join(entry, str(i)) for i in range(len(outputs))]
+        try:
+            if not all(is_read_only(path) for path in objects):
+                self.remove(key)  # Made writable through a hardlinked output, its content may have changed
+                log(f"dropped {key[:12]}, a cache object was made writable")
+                return unshare(outputs)
+            for path, output in zip(objects, outputs):
+                os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+                method = materialize(path, output)
+                os.utime(output)  # Newer than its inputs, as if just computed
+        except FileNotFoundError:
+            return unshare(outputs)  # Not cached, or evicted by another process meanwhile
+        with self.conn:
+            self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        log(f"hit {key[:12]}, {len(outputs)} outputs by {method}")
+        return True
+
+    def store(self, key, stage, outputs):
+        """Copy the outputs into the cache as read-only objects."""
+        entry = self.entry_dir(key)
+        partial = f"{entry}.{os.getpid()}.tmp"
+        os.makedirs(partial, exist_ok=True)
+        for i, output in enumerate(outputs):
+            clone(output, os.path.join(partial, str(i)), OBJECT_MODE)
+        try:
+            os.rename(partial, entry)
+        except OSError:
+            shutil.rmtree(partial)  # Stored by a concurrent run of the same stage
+            return
+        size = sum(os.path.getsize(output) for output in outputs)
+        now = time.time()
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (key, stage, size, now, now))
+        log(f"stored {key[:12]} ({size / 1e6:.1f} MB)")
+
+    def remove(self, key):
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        with self.conn:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def evict(self, max_bytes):
+        """Remove least recently used entries until the cache holds at most max_bytes."""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            self.remove(key)
+            total -= size
+            log(f"evicted {key[:12]} ({size / 1e6:.1f} MB)")
+            if total <= max_bytes:
+                break
+
+
+def run_cached(cache_dir, stage, inputs, outputs, command, tools=(), params=(), max_gb=None):
+    """Materialize the outputs from the cache, or run the command and cache them. Returns the exit code."""
+    cache = ResultCache(cache_dir)
+    try:
+        key = cache.key(stage, inputs, tools, params)
+        if cache.lookup(key, outputs):
+            if os.environ.get(HIT_MARKER_ENV):
+                open(os.environ[HIT_MARKER_ENV], 'w').close()
+            return 0
+        returncode = subprocess.run(command).returncode
+        if returncode != 0 or not all(os.path.exists(output) for output in outputs):
+            return returncode or 1
+        cache.store(key, stage, outputs)
+        if max_gb:
+            cache.evict(int(max_gb * 1e9))
+        return 0
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a workflow stage through the content-addressed result cache.")
+    parser.add_argument('cache_dir')
+    parser.add_argument('--stage', required=True, help="stage name, part of the key")
+    parser.add_argument('--inputs', nargs='+', required=True, help="files whose content is part of the key")
+    parser.add_argument('--outputs', nargs='+', required=True, help="files the command writes")
+    parser.add_argument('--tool', dest='tools', action='append', default=[],
+                        help="tool file or command (hashed) or version string, repeatable")
+    parser.add_argument('--param', dest='params', action='append', default=[],
+                        help="parameter string, part of the key, repeatable (use --param=VALUE)")
+    parser.add_argument('--max-gb', type=float, help="size cap of the cache, least recently used entries are evicted")
+    # The command after -- is split off before parsing, its options are not ours
+    argv = sys.argv[1:]
+    split = argv.index('--') if '--' in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    command = argv[split + 1:]
+    if not command:
+        parser.error("no command given after --")
+    sys.exit(run_cached(args.cache_dir, args.stage, args.inputs, args.outputs, command,
+                        args.tools, args.params, args.max_gb))
@@ -0,0 +1,136 @@
+'''
+Per-sample summary metrics for the comparison report, one projected read per file.
+
+Every result carries the sample key and nanogram load that the comparison plots
+group by (sample_key), so they can be stored and re-plotted without the files.
+
+scan_table_metrics reads the MS1 flags and injection times, and the isolation window
+targets only when the sample has no .acqmode.tsv sidecar, in a single read_scan_table
+call. The run start time comes from the sidecar.
+identification_metrics reads the precursors identified from a DIA-NN .stats.tsv or
+a QC_LCMS .mzidsummary.txt. extract_metrics runs either over many files in a pool
+of worker processes (worker_pool.py) and returns the results in input order.
+'''
+import csv
+import os
+import re
+import pandas as pd
+from acquisition_mode import classify_targets, read_sidecar
+from scan_table import read_scan_table
+from worker_pool import process_pool
+
+SCAN_TABLE_SUFFIXES = ('.features.parquet', '.features.csv')
+IDENTIFICATION_SUFFIXES = ('.stats.tsv', '.mzidsummary.txt')
+ng_regex = re.compile(r"\/([^\/]*?)(\d+_)?([\d]+ng)(.*?)(_\d)?\.")
+
+
+def sample_name(file, suffixes=SCAN_TABLE_SUFFIXES):
+    name = os.path.basename(file)
+    for suffix in suffixes:
+        name = name.replace(suffix, "")
+    return name
+
+
+def sample_key(file, no_match_name):
+    """(sample key, nanogram load) derived from the file path, e.g. 'HeLa_50ng_1' and 50.0.
+
+    DIA/DDA is removed from the key; the comparison adds the mode back when both occur.
+    The nanogram load is None when the path has no load in it.
+    """
+    ng_match = ng_regex.search(file)
+    nanogram_number = None
+    if ng_match is None:
+        print("No match", file)
+        keyname = no_match_name
+    else:
+        #print(ng_match.group(1), ng_match.group(2), ng_match.group(3), ng_match.group(4))
+        ng_part1 = ng_match.group(2)
+        ng_part2 = ng_match.group(3)
+
+        if ng_part1 is not None and 1 < len(ng_part1) <= 4:
+            ng_candidate = ng_part1.replace('_', '.') + ng_part2
+            nanogram_number = float(ng_candidate.replace('ng', ''))
+        elif ng_part2.startswith("0"):
+            ng_candidate = '0.' + ng_part2[1:]
+            nanogram_number = float(ng_candidate.replace('ng', ''))
+        elif ng_part1 is not None:
+            ng_candidate = ng_part1 + "_" + ng_part2
+            nanogram_number = float(ng_part2.replace('ng', ''))
+        else:
+            ng_candidate = ng_part2
+            nanogram_number = float(ng_part2.replace('ng', ''))
+
+        keyname = ng_match.group(1) + ng_candidate + ng_match.group(4)
+
+     # Remove 'DIA' or 'DDA' from keyname (if not part of the intentional filetype addition)
+    keyname = re.sub(r'(dia|dda)', '', keyname, flags=re.IGNORECASE)
+    return keyname, nanogram_number
+
+
+def scan_table_metrics(scan_table_file, acqmode_file=None):
+    """Mode, isolation window count, MS1/MS2 scan counts and median injection time of one per-scan table."""
+    columns = ['MS1', 'Injection Time'] if acqmode_file else ['MS1', 'Injection Time', 'Isolation Window Target']
+    scans = read_scan_table(scan_table_file, columns)
+    run_start = None
+    if acqmode_file:
+        acquisition = read_sidecar(acqmode_file)
+        mode, isolation_windows = acquisition['mode'], acquisition['isolation_windows']
+        run_start = acquisition['start_time']
+    else:
+        mode, isolation_windows = classify_targets(scans['Isolation Window Target'])
+        mode = "DIA" if mode == "DIA" else "DDA"
+    scan_number_MS1 = int(scans['MS1'].sum())
+    injection_time = scans['Injection Time'].median()  # NaN (MS1 scans, missing values) skipped
+    key, nanogram = sample_key(scan_table_file, sample_name(scan_table_file))
+    return {
+        'file': scan_table_file,
+        'sample': sample_name(scan_table_file),
+        'key': key,
+        'nanogram': nanogram,
+        'mode': mode,
+        'isolation_windows': isolation_windows,
+        'ms1_scans': scan_number_MS1,
+        'ms2_scans': len(scans) - scan_number_MS1,
+        'median_injection_time': None if pd.isna(injection_time) else float(injection_time),
+        'run_start': run_start,
+    }
+
+
+def identification_metrics(file_path):
+    """Precursors identified in a DIA-NN .stats.tsv or an .mzidsummary.txt, -1 when there are none."""
+    precursors_identified = -1  # Default to -1
+    mode = None
+    if file_path.endswith('.stats.tsv'):
+        with open(file_path, newline='') as file:
+            tsv_reader = csv.DictReader(file, delimiter='\t')
+            for row in tsv_reader:
+                try:
+                    precursors_identified += int(row['Precursors.Identified'])
+                except ValueError:
+                    pass  # Handle non-integer values gracefully
+        mode = 'DIA'
+    elif file_path.endswith('.mzidsummary.txt'):
+        with open(file_path, 'r') as file:
+            lines = file.readlines()
+            if len(lines) >= 2:
+                precursors_identified = int(lines[1].split()[0])
+        mode = 'DDA'
+    name = sample_name(file_path, IDENTIFICATION_SUFFIXES)
+    key, nanogram = sample_key(file_path, name)
+    return {'file': file_path, 'sample': name, 'key': key, 'nanogram': nanogram,
+            'mode': mode, 'precursors_identified': precursors_identified}
+
+
+def _call(job):
+    function, args = job
+    return function(*args)
+
+
+def extract_metrics(function, args_list, workers=None):
+    """[function(*args) for args in args_list], spread over worker processes."""
+    workers = min(workers or os.cpu_count() or 1, len(args_list))
+    jobs = [(function, args) for args in args_list]
+    if workers > 1:
+        with process_pool(workers) as pool:
+            return list(pool.map(_call, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    return [_call(job) for job in jobs]
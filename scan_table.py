@@ -0,0 +1,134 @@
+'''
+Per-scan table written by mzML-Parser.py and read by the DIA/DDA classifier,
+the report scripts and Compare.py.
+
+The default format is Parquet with typed columns: float64 with NaN for missing
+values, an int64 spectrum index and boolean MS1/Demultiplexing flags. The CSV
+with 'N/A' strings can still be exported by giving the output a .csv extension.
+read_scan_table returns the same typed DataFrame for either format, so the
+consumers only need to ask for the columns they use.
+'''
+import csv
+
+# Columns of the CSV export, in the original order
+CSV_COLUMNS = [
+    'Precursor Ion m/z',
+    'Retention Time',
+    'Injection Time',
+    'Isolation Window Target',
+    'Isolation window upper offset',
+    'Isolation window lower offset',
+    'MS1 Base Peak m/z',
+    'Base Peak Intensity',
+    'Total Ion Current',
+    'Demultiplexing',
+]
+FLOAT_COLUMNS = [column for column in CSV_COLUMNS if column != 'Demultiplexing']
+INT_COLUMNS = ['Spectrum Index']
+BOOL_COLUMNS = ['MS1', 'Demultiplexing']
+
+CHUNK_ROWS = 100_000
+
+
+def write_csv(rows, output_file):
+    """Stream rows to a CSV file with 'N/A' for missing values."""
+    with open(output_file, 'w', newline='') as file:
+        dict_writer = csv.DictWriter(file, CSV_COLUMNS, extrasaction='ignore')
+        dict_writer.writeheader()
+        dict_writer.writerows(rows)
+
+
+def _float_or_nan(value):
+    return float('nan') if value == 'N/A' else value
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_parquet(rows, output_file, chunk_size=CHUNK_ROWS):
+    """Stream rows to a Parquet file, one row group per chunk_size rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [(column, pa.int64()) for column in INT_COLUMNS]
+        + [(column, pa.float64()) for column in FLOAT_COLUMNS]
+        + [(column, pa.bool_()) for column in BOOL_COLUMNS]
+    )
+    with pq.ParquetWriter(output_file, schema) as writer:
+        for chunk in _chunks(rows, chunk_size):
+            columns = {column: [row.get(column) for row in chunk] for column in INT_COLUMNS}
+            for column in FLOAT_COLUMNS:
+                columns[column] = [_float_or_nan(row[column]) for row in chunk]
+            columns['MS1'] = [row.get('MS1', row['MS1 Base Peak m/z'] != 'N/A') for row in chunk]
+            columns['Demultiplexing'] = [row['Demultiplexing'] == 'Yes' for row in chunk]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+
+def write_table(rows, output_file):
+    """Write rows as CSV or Parquet depending on the output extension."""
+    if output_file.endswith('.csv'):
+        write_csv(rows, output_file)
+    else:
+        write_parquet(rows, output_file)
+
+
+def _csv_usecols(columns):
+    """CSV columns to load for the requested table columns ('MS1' needs the base peak m/z)."""
+    usecols = [column for column in columns if column in CSV_COLUMNS]
+    if 'MS1' in columns and 'MS1 Base Peak m/z' not in usecols:
+        usecols.append('MS1 Base Peak m/z')
+    return usecols
+
+
+def _typed_csv_chunk(df, columns):
+    """Derive the 'MS1' flag and a boolean 'Demultiplexing' for a chunk of the CSV export."""
+    if 'MS1' in columns:
+        df['MS1'] = df['MS1 Base Peak m/z'].notna()
+    if 'Demultiplexing' in df:
+        df['Demultiplexing'] = df['Demultiplexing'] == 'Yes'
+    return df[[column for column in columns if column in df]]
+
+
+def read_scan_table(file_path, columns=None):
+    """Load the per-scan table as a typed DataFrame, reading only the given columns.
+
+    Works for both the Parquet table and the CSV export. For a CSV the 'MS1' flag is
+    derived from 'MS1 Base Peak m/z' and 'Demultiplexing' is turned into a boolean.
+    """
+    import pandas as pd
+
+    if not file_path.endswith('.csv'):
+        return pd.read_parquet(file_path, columns=columns)
+
+    columns = CSV_COLUMNS if columns is None else columns
+    usecols = _csv_usecols(columns)
+    df = pd.read_csv(file_path, usecols=usecols,
+                     dtype={column: 'float64' for column in FLOAT_COLUMNS if column in usecols})
+    return _typed_csv_chunk(df, columns)
+
+
+def iter_scan_table(file_path, columns, chunk_rows=CHUNK_ROWS):
+    """Yield the per-scan table as typed DataFrames of about chunk_rows rows.
+
+    Lets a consumer stop early without reading the rest of the file.
+    """
+    import pandas as pd
+
+    if file_path.endswith('.csv'):
+        usecols = _csv_usecols(columns)
+        dtype = {column: 'float64' for column in FLOAT_COLUMNS if column in usecols}
+        for df in pd.read_csv(file_path, usecols=usecols, dtype=dtype, chunksize=chunk_rows):
+            yield _typed_csv_chunk(df, columns)
+    else:
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
@@ -0,0 +1,137 @@
+'''
+Resource telemetry of workflow jobs, one JSON record per job.
+
+python3 stage_telemetry.py report/telemetry/parse_mzML/S1.json --rule parse_mzML [--sample S1] [--threads 4]
+    [--mem-mb 4000] [--inputs a.mzML ...] [--append] -- python3 mzML-Parser.py ...
+
+Runs the command as a child process and records its wall time, user and system CPU
+time and peak RSS (from os.wait4, so exact rather than sampled), the bytes it read and
+wrote (Linux I/O accounting of the reaped child: rchar/wchar for all reads and writes,
+read_bytes/write_bytes for those that reached the disk), the input size and the exit
+code. stdin, stdout and stderr are the command's own, so shell redirections around the
+wrapper apply to the command. cache_hit is true when the command was result_cache.py and
+it materialized the outputs from the cache instead of running the stage. With --append
+the record of a job that runs more than one command is extended: times and bytes are
+summed, peak RSS is the largest, and the job counts as a cache hit if any command was.
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+IO_FIELDS = {'rchar': 'read_bytes', 'wchar': 'write_bytes', 'read_bytes': 'disk_read_bytes', 'write_bytes': 'disk_write_bytes'}
+SUMMED_FIELDS = ['wall_s', 'user_s', 'system_s'] + list(IO_FIELDS.values())
+HIT_MARKER_ENV = 'PIPELINE_CACHE_HIT_FILE'  # Created by result_cache.py on a hit
+
+
+def process_io():
+    """I/O counters of this process, including its reaped children; None where /proc is not available."""
+    try:
+        with open('/proc/self/io') as file:
+            counters = dict(line.split(': ') for line in file.read().splitlines() if line)
+    except OSError:
+        return None
+    return {name: int(counters[field]) for field, name in IO_FIELDS.items()}
+
+
+def run_measured(command, rule, sample=None, inputs=(), threads=None, mem_mb=None):
+    """Run the command and return (exit code, telemetry record)."""
+    # result_cache.py creates the marker file when it serves the outputs from the cache
+    marker = os.path.join(tempfile.gettempdir(), f"stage_telemetry.{os.getpid()}.hit")
+    if os.path.exists(marker):
+        os.remove(marker)  # Left by an earlier process with the same pid
+    io_before = process_io()
+    started = time.time()
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=dict(os.environ, **{HIT_MARKER_ENV: marker}))
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            break
+        except InterruptedError:
+            continue
+    wall = time.perf_counter() - start
+    io_after = process_io()
+    cache_hit = os.path.exists(marker)
+    if cache_hit:
+        os.remove(marker)
+    returncode = os.waitstatus_to_exitcode(status)
+    record = {
+        'rule': rule,
+        'sample': sample,
+        'host': platform.node(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'command': [' '.join(command)],
+        'exit_code': returncode,
+        'cache_hit': cache_hit,
+        'threads': threads,
+        'mem_mb_requested': mem_mb,
+        'wall_s': round(wall, 3),
+        'user_s': round(usage.ru_utime, 3),
+        'system_s': round(usage.ru_stime, 3),
+        'max_rss_mb': round(usage.ru_maxrss / 1024, 1),  # ru_maxrss is in KB on Linux
+        'input_bytes': sum(os.path.getsize(path) for path in inputs if os.path.exists(path)),
+    }
+    for name in IO_FIELDS.values():
+        record[name] = io_after[name] - io_before[name] if io_before and io_after else None
+    return returncode, record
+
+
+def merge_records(previous, record):
+    """A job's record extended with one more command."""
+    merged = dict(previous)
+    for field in SUMMED_FIELDS:
+        if previous.get(field) is not None and record[field] is not None:
+            merged[field] = round(previous[field] + record[field], 3)
+    merged['max_rss_mb'] = max(previous['max_rss_mb'], record['max_rss_mb'])
+    merged['exit_code'] = previous['exit_code'] or record['exit_code']
+    merged['cache_hit'] = bool(previous.get('cache_hit')) or record['cache_hit']
+    merged['command'] = previous['command'] + record['command']
+    return merged
+
+
+def write_record(path, record, append=False):
+    if append and os.path.exists(path):
+        with open(path) as file:
+            record = merge_records(json.load(file), record)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, 'w') as file:
+        json.dump(record, file, indent=1)
+    os.replace(partial, path)
+
+
+def load_records(telemetry_dir):
+    """All job records under the telemetry folder, as a list of dicts."""
+    records = []
+    for path in sorted(glob.glob(os.path.join(telemetry_dir, '**', '*.json'), recursive=True)):
+        with open(path) as file:
+            records.append(json.load(file))
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a workflow command and record its resource use as JSON.")
+    parser.add_argument('record', help="JSON file written for this job")
+    parser.add_argument('--rule', required=True)
+    parser.add_argument('--sample')
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--mem-mb', type=int, help="memory reserved for the job, to compare with its peak RSS")
+    parser.add_argument('--inputs', nargs='*', default=[], help="input files, their total size is recorded")
+    parser.add_argument('--append', action='store_true', help="add to the record of an earlier command of the same job")
+    # The command after -- is split off before parsing, its options are not ours
+    argv = sys.argv[1:]
+    split = argv.index('--') if '--' in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    command = argv[split + 1:]
+    if not command:
+        parser.error("no command given after --")
+
+    returncode, record = run_measured(command, args.rule, args.sample, args.inputs, args.threads, args.mem_mb)
+    write_record(args.record, record, args.append)
+    sys.exit(returncode)
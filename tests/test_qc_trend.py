@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+import qc_trend
+
+
+def make_runs(mode, isolation_windows, ms2_scans=None, key='HeLa_50ng_'):
+    n = len(isolation_windows)
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'sample': [f"{key}{mode}_{i}" for i in range(n)],
+        'key': key,
+        'mode': mode,
+        'run_start': pd.date_range('2024-01-01', periods=n, freq='D', tz='UTC'),
+        'ms1_scans': 5000 + rng.integers(-50, 50, n),
+        'ms2_scans': ms2_scans if ms2_scans is not None else 40000 + rng.integers(-300, 300, n),
+        'precursors_identified': 30000 + rng.integers(-200, 200, n),
+        'median_injection_time': 20 + rng.normal(0, 0.2, n),
+        'isolation_windows': isolation_windows,
+    })
+
+
+def test_stable_dda_series_has_no_window_scheme_outliers():
+    # Distinct precursor targets of the first MS2 scans, a few apart from run to run
+    runs = qc_trend.add_baselines(make_runs('DDA', np.random.default_rng(1).integers(1990, 2000, 30)))
+    outliers = qc_trend.find_outliers(runs)
+    assert runs['isolation_windows_baseline'].isna().all()
+    assert not (outliers['metric'] == 'isolation_windows').any()
+
+
+def test_dia_window_scheme_change_is_flagged_exactly():
+    windows = [40] * 25 + [41] + [40] * 4
+    runs = qc_trend.add_baselines(make_runs('DIA', windows))
+    flagged = qc_trend.find_outliers(runs)
+    flagged = flagged[flagged['metric'] == 'isolation_windows']
+    assert list(flagged['sample']) == ['HeLa_50ng_DIA_25']
+    assert flagged['baseline'].iloc[0] == 40
+
+
+def test_trailing_baseline_only_uses_earlier_runs():
+    runs = qc_trend.add_baselines(make_runs('DIA', [40] * 15), window=5, min_periods=3)
+    assert runs['ms2_scans_baseline'].iloc[:3].isna().all()
+    expected = np.median(runs['ms2_scans'].iloc[5:10])
+    assert runs['ms2_scans_baseline'].iloc[10] == pytest.approx(expected)
+
+
+def test_z_score_outlier_per_series():
+    ms2_scans = 40000 + np.tile([-200, -100, 0, 100, 200], 6)
+    ms2_scans[20] = 30000
+    dia = make_runs('DIA', [40] * 30, ms2_scans)
+    dda = make_runs('DDA', [2000] * 30, np.full(30, 20000))  # Its own series, not compared with DIA
+    runs = qc_trend.add_baselines(pd.concat([dia, dda], ignore_index=True))
+    outliers = qc_trend.find_outliers(runs)
+    ms2 = outliers[outliers['metric'] == 'ms2_scans']
+    assert list(ms2['sample']) == ['HeLa_50ng_DIA_20']
+    assert ms2['z'].iloc[0] < -qc_trend.Z_THRESHOLD
+    assert list(outliers.columns) == qc_trend.OUTLIER_COLUMNS
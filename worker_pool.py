@@ -0,0 +1,30 @@
+'''
+Process pools of the scripts (figure rendering, per-sample metrics, batch reports, sharded
+mzML parsing).
+
+The workers are started by a forkserver, or spawned where there is none, never forked
+from the calling script: by the time a pool starts, pandas and pyarrow may have
+started thread pools whose locks a fork would copy in whatever state they are in.
+Arguments and results are pickled either way. The functions a pool runs must be
+defined at module level, and a script that starts a pool keeps its work under
+if __name__ == "__main__", since every worker imports it again.
+
+By default the forkserver preloads report_plots (NumPy, matplotlib with Agg, reportlab),
+which start no threads on import, so the workers forked from it only import the rest.
+A pool that needs none of it names its own preload modules. pandas and pyarrow are
+never preloaded: importing pyarrow already starts a thread.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+FORKSERVER_PRELOAD = ['report_plots']
+
+
+def process_pool(workers, preload=FORKSERVER_PRELOAD):
+    """ProcessPoolExecutor of forkserver (else spawn) workers, the forkserver having imported preload."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(preload)
+    else:
+        context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(workers, mp_context=context)